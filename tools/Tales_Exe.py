@@ -1,4 +1,5 @@
 import argparse
+import time
 from pathlib import Path
 
 from pythonlib.games.ToolsNDX import ToolsNDX
@@ -56,6 +57,28 @@ def get_arguments(argv=None):
         help="(Optional) - Boolean to uses translations from the Repo to overwrite the one in the Data folder",
     )
 
+    sp_extract.add_argument(
+        "--stream-all",
+        required=False,
+        action="store_true",
+        help="(Optional) - Read all.dat straight from the Iso instead of copying it to 0_disc",
+    )
+
+    sp_extract.add_argument(
+        "--virtual-all",
+        required=False,
+        action="store_true",
+        help="(Optional) - Read all.dat members in place instead of writing them to 1_extracted/All",
+    )
+
+    sp_extract.add_argument(
+        "--workers",
+        required=False,
+        type=int,
+        default=None,
+        help="(Optional) - Processes used for the Story and Skits extraction, defaults to the core count",
+    )
+
     sp_extract.add_argument(
         "--only-changed",
         required=False,
@@ -87,6 +110,21 @@ def get_arguments(argv=None):
         help="(Required) - Can be relative path to the Repo folder",
     )
 
+    sp_insert.add_argument(
+        "--full-rebuild",
+        required=False,
+        action="store_true",
+        help="(Optional) - Rebuild the Iso from the original instead of patching the last build",
+    )
+
+    sp_insert.add_argument(
+        "--compression",
+        required=False,
+        choices=["fast", "release"],
+        default="release",
+        help="(Optional) - fast uses cheap but valid encodings (MSZIP cabs, greedy compto without comptolib.dll) for test builds",
+    )
+
     sp_insert.add_argument(
         "--with-proofreading",
         required=False,
@@ -125,6 +163,16 @@ def get_arguments(argv=None):
 
     return args
 
+
+def run_stage(name, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    # Stages of ToolsNDX show the level so fast and release builds can be compared
+    level = getattr(getattr(function, "__self__", None), "compression", None)
+    suffix = f" ({level} compression)" if level is not None else ""
+    print(f"{name} done in {time.perf_counter() - start:.2f}s{suffix}")
+    return result
+
 if __name__ == "__main__":
 
     args = get_arguments()
@@ -138,31 +186,36 @@ if __name__ == "__main__":
         ]
 
     tales_instance = ToolsNDX(
-        args.project.resolve(), insert_mask, args.only_changed
+        args.project.resolve(), insert_mask, args.only_changed,
+        getattr(args, "compression", "release")
     )
 
     if args.action == "insert":
 
         if args.file_type == "Menu":
-            tales_instance.pack_all_menu()
-            tales_instance.make_iso(Path(args.iso))
+            run_stage("Menu", tales_instance.pack_all_menu)
+            run_stage("Iso", tales_instance.make_iso, Path(args.iso), args.full_rebuild)
 
         if args.file_type == "Iso":
-            tales_instance.make_iso(args.iso.resolve())
+            run_stage("Iso", tales_instance.make_iso, args.iso.resolve(), args.full_rebuild)
+
+        elif args.file_type == "Main":
+            run_stage("Main archive", tales_instance.pack_main_archive)
 
         elif args.file_type == "Skits":
-            tales_instance.pack_all_skits()
+            run_stage("Skits", tales_instance.pack_all_skits)
 
         elif args.file_type == "Story":
-            tales_instance.pack_all_story_sb()
+            run_stage("Story", tales_instance.pack_all_story_sb)
 
         elif args.file_type == "All":
             print(args.iso.resolve())
-            tales_instance.pack_menu_bg()
-            tales_instance.pack_all_skits()
-            tales_instance.pack_all_story()
-            tales_instance.pack_all_menu()
-            tales_instance.patch_binaries()
+            run_stage("Menu backgrounds", tales_instance.pack_menu_bg)
+            run_stage("Skits", tales_instance.pack_all_skits)
+            run_stage("Story", tales_instance.pack_all_story)
+            run_stage("Menu", tales_instance.pack_all_menu)
+            run_stage("Main archive", tales_instance.pack_main_archive)
+            run_stage("Binaries", tales_instance.patch_binaries)
 
 
     if args.action == "extract":
@@ -172,14 +225,14 @@ if __name__ == "__main__":
             tales_instance.extract_all_menu(args.replace)
 
         elif args.file_type == "Iso":
-            tales_instance.extract_iso(Path(args.iso.resolve()))
-            tales_instance.extract_main_archive()
+            tales_instance.extract_iso(Path(args.iso.resolve()), stream_all=args.stream_all)
+            tales_instance.extract_main_archive(write_files=not args.virtual_all)
 
         elif args.file_type == "Skits":
-            tales_instance.extract_all_skits(keep_translations=True)
+            tales_instance.extract_all_skits(keep_translations=True, workers=args.workers)
 
         elif args.file_type == "Story":
-            tales_instance.extract_all_story_sb(keep_translations=True)
+            tales_instance.extract_all_story_sb(keep_translations=True, workers=args.workers)
             
         elif args.file_type == "Map":
             tales_instance.extract_all_map(args.replace)
@@ -189,11 +242,11 @@ if __name__ == "__main__":
             tales_instance.extract_all_sysdata()
 
         elif args.file_type == "All":
-            tales_instance.extract_iso(Path(args.iso.resolve()))
-            tales_instance.extract_main_archive()
+            tales_instance.extract_iso(Path(args.iso.resolve()), stream_all=args.stream_all)
+            tales_instance.extract_main_archive(write_files=not args.virtual_all)
             #tales_instance.extract_all_map(args.replace)
             #tales_instance.extract_all_sysdata()
             tales_instance.extract_field()
-            tales_instance.extract_all_story_sb(args.replace)
+            tales_instance.extract_all_story_sb(args.replace, workers=args.workers)
             tales_instance.extract_archives()
             tales_instance.extract_all_menu(args.replace)
\ No newline at end of file
@@ -1,4 +1,5 @@
 import io
+import mmap
 import struct
 from io import BytesIO
 from pathlib import Path
@@ -6,12 +7,22 @@ from typing import Union
 
 
 class FileIO(object):
-    def __init__(self, path: Union[Path, str, BytesIO, bytes], mode="r+b", endian="little"):
+    def __init__(self, path: Union[Path, str, BytesIO, bytes, bytearray, memoryview, mmap.mmap], mode="r+b", endian="little"):
         self.mode: str = mode
         self._isBitesIO = False
-        if type(path) is bytes:
+        self._isShared = False
+        if type(path) is mmap.mmap:
+            # Shared mapping, read in place and left open on exit
+            self.path = None
+            self.f = path
+            self._isBitesIO = True
+            self._isShared = True
+            self.is_memory_file = True
+        elif type(path) in (bytes, bytearray, memoryview):
+            # Members of mapped archives come as memoryviews
             self.path = None
             self.f = BytesIO(path) # type: ignore
+            self._isBitesIO = True
             self.is_memory_file = True
         elif type(path) is BytesIO:
             self.path = None
@@ -32,10 +43,11 @@ class FileIO(object):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.f.close()
+        self.close()
 
     def close(self):
-        self.f.close()
+        if not self._isShared:
+            self.f.close()
 
     def tell(self):
         return self.f.tell()
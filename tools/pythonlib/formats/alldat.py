@@ -0,0 +1,303 @@
+from array import array
+from dataclasses import dataclass
+import hashlib
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+from pathlib import Path
+
+import numpy as np
+
+ALL_TABLE_OFFSET = 0x1FF624
+ALL_ALIGN = 0x800
+FILENAME_TABLE_START = 0x187AD0
+FILENAME_TABLE_END = 0x18C41F
+
+
+@dataclass
+class all_entry:
+    offset: int
+    size: int
+    hash: str
+
+
+def read_all_table(eboot) -> list[all_entry]:
+    # Unpack everything after the table start in one go, then cut at the 0 hash
+    data = memoryview(eboot)[ALL_TABLE_OFFSET:]
+    table = array("I")
+    table.frombytes(data[:len(data) - (len(data) % 12)])
+    if sys.byteorder == "big":
+        table.byteswap()
+
+    offsets, sizes, hashes = table[0::3], table[1::3], table[2::3]
+    count = hashes.index(0) if 0 in hashes else len(hashes)
+    data.release()
+
+    return [all_entry(offsets[i], sizes[i], "%08X" % hashes[i]) for i in range(count)]
+
+
+def copy_range(src_fd: int, dest, offset: int, size: int, view: memoryview) -> None:
+
+    # Kernel side copy when available, otherwise a zero-copy slice of the mmap
+    if hasattr(os, "copy_file_range"):
+        try:
+            while size > 0:
+                copied = os.copy_file_range(src_fd, dest.fileno(), size, offset)
+                if copied == 0:
+                    break
+                offset += copied
+                size -= copied
+        except OSError:
+            pass
+
+    while size > 0:
+        written = dest.write(view[offset:offset + size])
+        offset += written
+        size -= written
+
+
+def extract_all_members(all_dat: "AllDat", destination: Path) -> None:
+
+    for folder in {(destination / name).parent for name in all_dat.members}:
+        folder.mkdir(parents=True, exist_ok=True)
+
+    for name, entry in all_dat.members.items():
+        with open(destination / name, "wb", buffering=0) as output_file:
+            copy_range(all_dat.fileno(), output_file, all_dat.base_offset + entry.offset, entry.size, all_dat._view)
+
+
+class AllDat:
+    """
+    Read-only view of all.dat, members are addressed by their logical name
+    (map/pack/ep_000_010.cab) and served from an mmap of the archive.
+    all_path can also be the UMD itself with base_offset set to the all.dat extent.
+    """
+
+    def __init__(self, all_path: Path, entries: list[all_entry], hashes: dict[str, str],
+                 base_offset: int = 0, size: int = None) -> None:
+        self.all_path = all_path
+        self.entries = entries
+        self.members: dict[str, all_entry] = {hashes.get(entry.hash, entry.hash): entry for entry in entries}
+        self.base_offset = base_offset
+        self.size = size if size is not None else os.path.getsize(all_path) - base_offset
+
+        self._file = open(all_path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+    @staticmethod
+    def from_eboot(eboot_path: Path, all_path: Path, hashes: dict[str, str]) -> "AllDat":
+        with open(eboot_path, "rb") as eboot, \
+                mmap.mmap(eboot.fileno(), 0, access=mmap.ACCESS_READ) as eboot_map:
+            entries = read_all_table(eboot_map)
+        return AllDat(all_path, entries, hashes)
+
+    def listdir(self, folder: str) -> list[str]:
+        folder = folder.strip("/")
+        return [name for name in self.members if name.rpartition("/")[0] == folder]
+
+    def get_entry(self, name: str) -> all_entry:
+        return self.members[name]
+
+    def view(self, name: str) -> memoryview:
+        entry = self.members[name]
+        start = self.base_offset + entry.offset
+        return self._view[start:start + entry.size]
+
+    def read(self, name: str) -> bytes:
+        return bytes(self.view(name))
+
+    def open(self, name: str) -> io.BytesIO:
+        return io.BytesIO(self.view(name))
+
+    def fileno(self) -> int:
+        return self._file.fileno()
+
+    def copy_to(self, destination: Path) -> None:
+        with open(destination, "wb", buffering=0) as output_file:
+            copy_range(self.fileno(), output_file, self.base_offset, self.size, self._view)
+
+    def close(self) -> None:
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.members
+
+    def __iter__(self):
+        return iter(self.members)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def align_all(size: int) -> int:
+    return (size + ALL_ALIGN - 1) & ~(ALL_ALIGN - 1)
+
+
+def get_original_layout(entries: list[all_entry]) -> dict:
+
+    # A member can use everything up to the next member, shared offsets can't be touched in place
+    starts = sorted({entry.offset for entry in entries})
+    next_start = {start: end for start, end in zip(starts, starts[1:])}
+    counts = {}
+    for entry in entries:
+        counts[entry.offset] = counts.get(entry.offset, 0) + 1
+
+    files = {}
+    for entry in entries:
+        alloc = next_start.get(entry.offset, entry.offset + align_all(entry.size)) - entry.offset
+        if counts[entry.offset] > 1:
+            alloc = 0
+        files[entry.hash] = {"offset": entry.offset, "size": entry.size, "alloc": alloc, "hash": "original"}
+
+    return {
+        "end": align_all(max(entry.offset + entry.size for entry in entries)),
+        "files": files
+    }
+
+
+def pack_all_dat(all_dat: AllDat, order: list[str], patched_path: Path, out_all: Path, out_eboot: Path,
+                 layout_path: Path) -> int:
+    """
+    Updates out_all in place, unchanged members keep their offset. The whole
+    table of out_eboot is written from the layout, out_eboot can be a fresh
+    copy of the original while out_all holds members moved by earlier runs.
+    Returns the amount of bytes written.
+    """
+    layout = None
+    if layout_path.exists() and out_all.exists():
+        with open(layout_path, encoding="utf-8") as f:
+            layout = json.load(f)
+
+    # No previous build, start from the original layout
+    if layout is None:
+        out_all.parent.mkdir(parents=True, exist_ok=True)
+        all_dat.copy_to(out_all)
+        layout = get_original_layout(all_dat.entries)
+
+    names = {entry.hash: name for name, entry in all_dat.members.items()}
+    written = 0
+
+    with open(out_all, "r+b") as all_file, open(out_eboot, "r+b") as eboot:
+        for hash_ in order:
+            name = names[hash_]
+            source = patched_path / name
+            current = layout["files"][hash_]
+
+            if source.exists():
+                with open(source, "rb") as f:
+                    data = f.read()
+                key = hashlib.sha1(data).hexdigest()
+            else:
+                data = None
+                key = "original"
+
+            # Copies of untouched members are still in the original slot, only their hash is recorded
+            if current["hash"] == "original" and data is not None:
+                original = all_dat.view(name)
+                if len(data) == len(original) and data == original:
+                    current["hash"] = key
+                original.release()
+
+            if current["hash"] != key:
+                if data is None:
+                    data = all_dat.view(name)
+                size = len(data)
+
+                # Keep the slot when the member still fits, else move it to the tail
+                if align_all(size) <= current["alloc"]:
+                    offset, alloc = current["offset"], current["alloc"]
+                else:
+                    offset, alloc = layout["end"], align_all(size)
+                    layout["end"] += alloc
+
+                all_file.seek(offset)
+                all_file.write(data)
+                all_file.write(b"\x00" * (align_all(size) - size))
+                layout["files"][hash_] = {"offset": offset, "size": size, "alloc": alloc, "hash": key}
+                written += size
+
+        # 12 bytes per member, cheaper than tracking which entries the eboot already has
+        table = bytearray(12 * len(order))
+        for index, hash_ in enumerate(order):
+            entry = layout["files"][hash_]
+            struct.pack_into("<3I", table, index * 12, entry["offset"], entry["size"], int(hash_, 16))
+        eboot.seek(ALL_TABLE_OFFSET)
+        eboot.write(table)
+
+    with open(layout_path, "w", encoding="utf-8") as f:
+        json.dump(layout, f, indent=4)
+
+    return written
+
+
+def get_hash(file_name: str) -> str:
+    name_hash = 0
+    for char in file_name.upper():
+        name_hash = (name_hash * 137 + ord(char)) & 0xFFFFFFFF
+    return "%08X" % name_hash
+
+
+def get_hashes(names: list[str]) -> np.ndarray:
+
+    # Same as get_hash (h = h * 137 + c) for every name at once, one column per character
+    chars = np.array([name.upper().encode("ascii") for name in names], dtype=bytes)
+    chars = chars.view(np.uint8).reshape(len(names), -1)
+    name_hashes = np.zeros(len(names), dtype=np.uint32)
+    for column in chars.T:
+        name_hashes = np.where(column != 0, name_hashes * np.uint32(137) + column, name_hashes)
+    return name_hashes
+
+
+def read_filename_table(eboot) -> list[str]:
+    data = bytes(eboot[FILENAME_TABLE_START:FILENAME_TABLE_END])
+    return [name.decode("ascii") for name in data.split(b"\x00") if name and name.isascii()]
+
+
+def get_candidate_names(table_names: list[str], known_names: list[str]) -> list[str]:
+    table_names = list(dict.fromkeys(table_names))
+    longest_first = sorted(table_names, key=len, reverse=True)
+
+    # Folder + tail patterns seen in the known names, battle/charsnd/e001 + _0t.sid for example
+    patterns = {}
+    for name in known_names:
+        folder, _, base = name.rpartition("/")
+        patterns.setdefault((folder, Path(base).suffix), None)
+        for table_name in longest_first:
+            if base.upper().startswith(table_name.upper()):
+                patterns.setdefault((folder, base[len(table_name):]), None)
+                break
+
+    candidates = []
+    for folder, tail in patterns:
+        candidates.extend(f"{folder}/{name}{tail}" if folder else f"{name}{tail}" for name in table_names)
+    return candidates
+
+
+def resolve_hashes(eboot, unknown: set[str], hashes: dict[str, str]) -> dict[str, str]:
+    candidates = get_candidate_names(read_filename_table(eboot), list(hashes.values()))
+    if len(candidates) == 0:
+        return {}
+
+    # Reverse index of every candidate, first name wins on collisions
+    index: dict[str, str] = {}
+    for name, name_hash in zip(candidates, get_hashes(candidates).tolist()):
+        index.setdefault("%08X" % name_hash, name)
+
+    return {hash_: index[hash_] for hash_ in unknown if hash_ in index}
+
+
+def save_hashes(hashes_path: Path, hashes: dict[str, str]) -> None:
+    with open(hashes_path, "w", encoding="utf-8") as f:
+        json.dump(hashes, f, indent=0)
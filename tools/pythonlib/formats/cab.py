@@ -1,18 +1,873 @@
-import shutil
-from dataclasses import dataclass
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import heapq
 import struct
-from .FileIO import FileIO
-import os
+import time
+import zlib
 from pathlib import Path
-import subprocess
+from typing import Optional, Union
 
+import numpy as np
 
-def extract_cab_file(cab_file_path:Path, folder_path:Path):
+from ..utils.blob_cache import remove_file
+
+CAB_SIGNATURE = b"MSCF"
+CAB_HEADER = struct.Struct("<4sIIIIIBBHHHHH")
+CAB_FOLDER = struct.Struct("<IHH")
+CAB_FILE = struct.Struct("<IIHHHH")
+CAB_DATA = struct.Struct("<IHH")
+
+FLAG_PREV_CABINET = 0x1
+FLAG_NEXT_CABINET = 0x2
+FLAG_RESERVE_PRESENT = 0x4
+ATTRIB_NAME_IS_UTF = 0x80
+
+COMPRESS_NONE = 0
+COMPRESS_MSZIP = 1
+COMPRESS_QUANTUM = 2
+COMPRESS_LZX = 3
+
+MSZIP_WINDOW = 0x8000
+LZX_FRAME_SIZE = 0x8000
+
+# Settings the game cabs were built with (makecab /D CompressionMemory=15 /D ReservePerCabinetSize=8)
+GAME_LZX_WINDOW_BITS = 15
+GAME_HEADER_RESERVE = b"\x00" * 8
+GAME_SET_ID = 0x1128
+
+# Folder compression of each build profile, MSZIP is only meant for test builds
+CAB_COMPRESSION_LEVELS = {"fast": COMPRESS_MSZIP, "release": COMPRESS_LZX}
+
+LZX_MIN_MATCH = 2
+LZX_MAX_MATCH = 257
+LZX_NUM_CHARS = 256
+LZX_BLOCKTYPE_VERBATIM = 1
+LZX_BLOCKTYPE_ALIGNED = 2
+LZX_BLOCKTYPE_UNCOMPRESSED = 3
+LZX_PRETREE_NUM_ELEMENTS = 20
+LZX_ALIGNED_NUM_ELEMENTS = 8
+LZX_NUM_PRIMARY_LENGTHS = 7
+LZX_NUM_SECONDARY_LENGTHS = 249
+LZX_POSITION_SLOTS = {15: 30, 16: 32, 17: 34, 18: 36, 19: 38, 20: 42, 21: 50}
+
+LZX_EXTRA_BITS = []
+for _slot in range(51):
+    LZX_EXTRA_BITS.append(min(max(_slot // 2 - 1, 0), 17))
+LZX_POSITION_BASE = [0]
+for _bits in LZX_EXTRA_BITS[:-1]:
+    LZX_POSITION_BASE.append(LZX_POSITION_BASE[-1] + (1 << _bits))
+
+
+@dataclass
+class cab_folder:
+    offset: int
+    data_count: int
+    compression: int
+
+
+@dataclass
+class cab_file:
+    name: str
+    size: int
+    folder_index: int
+    folder_offset: int
+    date: int
+    time: int
+    attribs: int
+    decode_time: float = field(default=0.0, repr=False)
+
+
+class BitReader:
+    # LZX bitstream, 16-bit little endian words read from the most significant bit
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        self.pos = 0
+        self.buffer = 0
+        self.bits_left = 0
+
+    def ensure(self, count: int) -> None:
+        while self.bits_left < count:
+            word = self.data[self.pos:self.pos + 2]
+            self.pos += 2
+            value = word[0] | (word[1] << 8) if len(word) == 2 else (word[0] if word else 0)
+            self.buffer = (self.buffer << 16) | value
+            self.bits_left += 16
+
+    def peek(self, count: int) -> int:
+        self.ensure(count)
+        return (self.buffer >> (self.bits_left - count)) & ((1 << count) - 1)
+
+    def remove(self, count: int) -> None:
+        self.bits_left -= count
+        self.buffer &= (1 << self.bits_left) - 1
+
+    def read(self, count: int) -> int:
+        if count == 0:
+            return 0
+        value = self.peek(count)
+        self.remove(count)
+        return value
+
+    def read_bytes(self, count: int) -> bytes:
+        value = self.data[self.pos:self.pos + count]
+        self.pos += count
+        return value
+
+
+class HuffmanTable:
+    # Canonical code of the LZX trees, decoded with a single lookup of max_bits
+    def __init__(self, lengths: list[int]) -> None:
+        self.max_bits = max(lengths) if lengths else 0
+        if self.max_bits == 0:
+            self.table = None
+            return
+
+        table = [None] * (1 << self.max_bits)
+        code = 0
+        for length in range(1, self.max_bits + 1):
+            for symbol, symbol_length in enumerate(lengths):
+                if symbol_length != length:
+                    continue
+                span = 1 << (self.max_bits - length)
+                start = code << (self.max_bits - length)
+                if start + span > len(table):
+                    raise ValueError("Invalid LZX Huffman table")
+                table[start:start + span] = [(symbol, length)] * span
+                code += 1
+            code <<= 1
+        self.table = table
+
+    def decode(self, bits: BitReader) -> int:
+        entry = self.table[bits.peek(self.max_bits)] if self.table is not None else None
+        if entry is None:
+            raise ValueError("Invalid LZX Huffman code")
+        bits.remove(entry[1])
+        return entry[0]
+
+
+class LzxDecoder:
+    """
+    LZX decoder for one CAB folder, the folder is a single stream of 32K frames
+    with the window, repeated offsets and tree lengths kept between frames.
+    """
+
+    def __init__(self, window_bits: int) -> None:
+        if window_bits not in LZX_POSITION_SLOTS:
+            raise ValueError(f"Unsupported LZX window size of {window_bits} bits")
+        self.main_elements = LZX_NUM_CHARS + LZX_POSITION_SLOTS[window_bits] * 8
+        self.main_lengths = [0] * self.main_elements
+        self.length_lengths = [0] * LZX_NUM_SECONDARY_LENGTHS
+
+    def read_lengths(self, bits: BitReader, lengths: list[int], first: int, last: int) -> None:
+        pretree = HuffmanTable([bits.read(4) for _ in range(LZX_PRETREE_NUM_ELEMENTS)])
+        x = first
+        while x < last:
+            code = pretree.decode(bits)
+            if code == 17:
+                run = min(bits.read(4) + 4, last - x)
+                lengths[x:x + run] = [0] * run
+                x += run
+            elif code == 18:
+                run = min(bits.read(5) + 20, last - x)
+                lengths[x:x + run] = [0] * run
+                x += run
+            elif code == 19:
+                run = min(bits.read(1) + 4, last - x)
+                code = pretree.decode(bits)
+                value = (lengths[x] - code) % 17
+                lengths[x:x + run] = [value] * run
+                x += run
+            else:
+                lengths[x] = (lengths[x] - code) % 17
+                x += 1
+
+    def decompress(self, data: bytes, size: int) -> bytearray:
+        bits = BitReader(data)
+        out = bytearray()
+        r0 = r1 = r2 = 1
+        block_type = 0
+        block_remaining = 0
+        block_length = 0
+        main_tree = length_tree = aligned_tree = None
+        intel_started = False
+        intel_frames = []
+
+        intel_filesize = 0
+        if bits.read(1):
+            intel_filesize = (bits.read(16) << 16) | bits.read(16)
+
+        while len(out) < size:
+            frame_start = len(out)
+            frame_end = min(frame_start + LZX_FRAME_SIZE, size)
+
+            while len(out) < frame_end:
+                if block_remaining == 0:
+                    if block_type == LZX_BLOCKTYPE_UNCOMPRESSED and block_length & 1:
+                        bits.read_bytes(1)
+
+                    block_type = bits.read(3)
+                    block_remaining = block_length = (bits.read(16) << 8) | bits.read(8)
+
+                    if block_type == LZX_BLOCKTYPE_ALIGNED:
+                        aligned_tree = HuffmanTable([bits.read(3) for _ in range(LZX_ALIGNED_NUM_ELEMENTS)])
+
+                    if block_type in (LZX_BLOCKTYPE_VERBATIM, LZX_BLOCKTYPE_ALIGNED):
+                        self.read_lengths(bits, self.main_lengths, 0, LZX_NUM_CHARS)
+                        self.read_lengths(bits, self.main_lengths, LZX_NUM_CHARS, self.main_elements)
+                        self.read_lengths(bits, self.length_lengths, 0, LZX_NUM_SECONDARY_LENGTHS)
+                        main_tree = HuffmanTable(self.main_lengths)
+                        length_tree = HuffmanTable(self.length_lengths)
+                        if self.main_lengths[0xE8] != 0:
+                            intel_started = True
+
+                    elif block_type == LZX_BLOCKTYPE_UNCOMPRESSED:
+                        intel_started = True
+                        # Realign to 16 bits, a whole word is skipped when already aligned
+                        if bits.bits_left == 0:
+                            bits.ensure(16)
+                        bits.bits_left = 0
+                        bits.buffer = 0
+                        r0, r1, r2 = struct.unpack("<3I", bits.read_bytes(12))
+
+                    else:
+                        raise ValueError(f"Invalid LZX block type {block_type}")
+
+                run = min(block_remaining, frame_end - len(out))
+                start = len(out)
+
+                if block_type == LZX_BLOCKTYPE_UNCOMPRESSED:
+                    chunk = bits.read_bytes(run)
+                    if len(chunk) != run:
+                        raise ValueError("LZX uncompressed block goes past the end of the data")
+                    out += chunk
+
+                else:
+                    aligned = block_type == LZX_BLOCKTYPE_ALIGNED
+                    target = start + run
+                    while len(out) < target:
+                        element = main_tree.decode(bits)
+                        if element < LZX_NUM_CHARS:
+                            out.append(element)
+                            continue
+
+                        element -= LZX_NUM_CHARS
+                        match_length = element & LZX_NUM_PRIMARY_LENGTHS
+                        if match_length == LZX_NUM_PRIMARY_LENGTHS:
+                            match_length += length_tree.decode(bits)
+                        match_length += LZX_MIN_MATCH
+
+                        slot = element >> 3
+                        if slot > 2:
+                            if slot == 3:
+                                match_offset = 1
+                            else:
+                                extra = LZX_EXTRA_BITS[slot]
+                                match_offset = LZX_POSITION_BASE[slot] - 2
+                                if aligned and extra >= 3:
+                                    match_offset += (bits.read(extra - 3) << 3) + aligned_tree.decode(bits)
+                                else:
+                                    match_offset += bits.read(extra)
+                            r2, r1, r0 = r1, r0, match_offset
+                        elif slot == 0:
+                            match_offset = r0
+                        elif slot == 1:
+                            match_offset = r1
+                            r1, r0 = r0, match_offset
+                        else:
+                            match_offset = r2
+                            r2, r0 = r0, match_offset
+
+                        position = len(out)
+                        if match_offset > position:
+                            raise ValueError("LZX match offset goes before the start of the data")
+
+                        source = position - match_offset
+                        if match_offset >= match_length:
+                            out += out[source:source + match_length]
+                        else:
+                            pattern = out[source:position]
+                            out += (pattern * (match_length // match_offset + 1))[:match_length]
+
+                block_remaining -= len(out) - start
+                if block_remaining < 0:
+                    raise ValueError("LZX match goes past the end of its block")
+
+            if len(out) > frame_end:
+                raise ValueError("LZX data decoded past the end of the frame")
+
+            if intel_started and intel_filesize:
+                intel_frames.append(frame_start)
+
+            # Frames start on a 16-bit boundary
+            if bits.bits_left > 0:
+                bits.ensure(16)
+            bits.remove(bits.bits_left & 15)
+
+        if intel_frames:
+            out = undo_e8_translation(out, intel_filesize, intel_frames)
+        return out
+
+
+def undo_e8_translation(data: bytearray, filesize: int, frames: list[int]) -> bytearray:
+    # CALL targets were stored as absolute offsets, translated back on a copy so the window stays intact
+    result = bytearray(data)
+    for frame_start in frames:
+        frame_size = min(LZX_FRAME_SIZE, len(data) - frame_start)
+        if frame_size <= 10 or frame_start >= LZX_FRAME_SIZE * LZX_FRAME_SIZE:
+            continue
+
+        pos = frame_start
+        end = frame_start + frame_size - 10
+        while True:
+            pos = result.find(0xE8, pos, end)
+            if pos < 0:
+                break
+            absolute = struct.unpack_from("<i", result, pos + 1)[0]
+            if -pos <= absolute < filesize:
+                relative = absolute - pos if absolute >= 0 else absolute + filesize
+                struct.pack_into("<i", result, pos + 1, relative)
+            pos += 5
+    return result
+
+
+class BitWriter:
+    # Inverse of BitReader, bits packed from the top of 16-bit little endian words
+    def __init__(self) -> None:
+        self.out = bytearray()
+        self.buffer = 0
+        self.count = 0
+
+    def write(self, value: int, count: int) -> None:
+        self.buffer = (self.buffer << count) | value
+        self.count += count
+        while self.count >= 16:
+            self.count -= 16
+            self.out += struct.pack("<H", (self.buffer >> self.count) & 0xFFFF)
+        self.buffer &= (1 << self.count) - 1
+
+    def align(self) -> None:
+        if self.count:
+            self.write(0, 16 - self.count)
+
+    @property
+    def bit_length(self) -> int:
+        return len(self.out) * 8 + self.count
+
+
+def get_huffman_lengths(frequencies: list[int], max_bits: int) -> list[int]:
+    lengths = [0] * len(frequencies)
+
+    # Decoders reject incomplete codes, so there are always at least two symbols
+    used = [symbol for symbol, frequency in enumerate(frequencies) if frequency]
+    for symbol in range(len(frequencies)):
+        if len(used) >= 2:
+            break
+        if symbol not in used:
+            used.append(symbol)
+
+    weights = [max(frequencies[symbol], 1) for symbol in used]
+    while True:
+        heap = [(weight, index, [index]) for index, weight in enumerate(weights)]
+        heapq.heapify(heap)
+        depths = [0] * len(used)
+        counter = len(heap)
+        while len(heap) > 1:
+            weight_a, _, group_a = heapq.heappop(heap)
+            weight_b, _, group_b = heapq.heappop(heap)
+            for index in group_a + group_b:
+                depths[index] += 1
+            heapq.heappush(heap, (weight_a + weight_b, counter, group_a + group_b))
+            counter += 1
+
+        if max(depths) <= max_bits:
+            break
+        # Flatten the distribution until the code fits
+        weights = [(weight >> 1) | 1 for weight in weights]
+
+    for symbol, depth in zip(used, depths):
+        lengths[symbol] = depth
+    return lengths
+
+
+def get_huffman_codes(lengths: list[int]) -> list[int]:
+    codes = [0] * len(lengths)
+    code = 0
+    for length in range(1, max(lengths) + 1):
+        for symbol, symbol_length in enumerate(lengths):
+            if symbol_length == length:
+                codes[symbol] = code
+                code += 1
+        code <<= 1
+    return codes
+
+
+def get_match_length(data: bytes, source: int, position: int, limit: int) -> int:
+    # Bisect on slice compares instead of walking byte by byte
+    if data[source:source + limit] == data[position:position + limit]:
+        return limit
+    low, high = 0, limit
+    while high - low > 1:
+        middle = (low + high) >> 1
+        if data[source + low:source + middle] == data[position + low:position + middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def encode_tree_lengths(previous: list[int], lengths: list[int]) -> list[tuple[int, int, int]]:
+    # Pretree symbols as (code, extra value, extra bits), zero runs use codes 17 and 18
+    items = []
+    x = 0
+    while x < len(lengths):
+        if lengths[x] == 0:
+            run = 1
+            while x + run < len(lengths) and lengths[x + run] == 0 and run < 51:
+                run += 1
+            if run >= 20:
+                items.append((18, run - 20, 5))
+                x += run
+                continue
+            if run >= 4:
+                items.append((17, run - 4, 4))
+                x += run
+                continue
+        items.append(((previous[x] - lengths[x]) % 17, 0, 0))
+        x += 1
+    return items
+
+
+def write_tree_lengths(bits: BitWriter, previous: list[int], lengths: list[int]) -> None:
+    items = encode_tree_lengths(previous, lengths)
+    frequencies = [0] * LZX_PRETREE_NUM_ELEMENTS
+    for code, _, _ in items:
+        frequencies[code] += 1
+
+    pretree_lengths = get_huffman_lengths(frequencies, 15)
+    pretree_codes = get_huffman_codes(pretree_lengths)
+    for length in pretree_lengths:
+        bits.write(length, 4)
+    for code, extra, extra_bits in items:
+        bits.write(pretree_codes[code], pretree_lengths[code])
+        if extra_bits:
+            bits.write(extra, extra_bits)
+
+
+class LzxEncoder:
+    """
+    LZX encoder producing one verbatim block per 32K frame, each frame is
+    returned separately since a CFDATA block holds exactly one frame.
+    """
+
+    def __init__(self, window_bits: int, max_chain: int = 32) -> None:
+        if window_bits not in LZX_POSITION_SLOTS:
+            raise ValueError(f"Unsupported LZX window size of {window_bits} bits")
+        self.window_size = 1 << window_bits
+        self.position_slots = LZX_POSITION_SLOTS[window_bits]
+        self.main_elements = LZX_NUM_CHARS + self.position_slots * 8
+        self.max_chain = max_chain
+
+    def find_matches(self, data: bytes, start: int, end: int, chains: dict) -> list:
+        tokens = []
+        max_offset = self.window_size - 3
+        position = start
+        while position < end:
+            limit = min(LZX_MAX_MATCH, end - position)
+            best_length = best_offset = 0
+
+            if limit >= 3:
+                key = data[position:position + 3]
+                candidates = chains.get(key)
+                if candidates:
+                    for source in reversed(candidates[-self.max_chain:]):
+                        offset = position - source
+                        if offset > max_offset:
+                            break
+                        # Can't beat the current best without matching one byte further
+                        if best_length and data[source + best_length] != data[position + best_length]:
+                            continue
+                        length = get_match_length(data, source, position, limit)
+                        if length > best_length:
+                            best_length, best_offset = length, offset
+                            if length == limit:
+                                break
+
+            if best_length >= 3:
+                tokens.append((best_length, best_offset))
+                step = best_length
+            else:
+                tokens.append(data[position])
+                step = 1
+
+            for index in range(position, min(position + step, len(data) - 2)):
+                chains.setdefault(data[index:index + 3], []).append(index)
+            position += step
+        return tokens
+
+    def compress(self, data: bytes) -> list[bytes]:
+        data = bytes(data)
+        chains: dict[bytes, list[int]] = {}
+        main_lengths = [0] * self.main_elements
+        length_lengths = [0] * LZX_NUM_SECONDARY_LENGTHS
+        r0 = r1 = r2 = 1
+        frames = []
+
+        for frame_start in range(0, len(data), LZX_FRAME_SIZE):
+            frame_end = min(frame_start + LZX_FRAME_SIZE, len(data))
+            tokens = self.find_matches(data, frame_start, frame_end, chains)
+            bits = BitWriter()
+            if frame_start == 0:
+                # No E8 call translation
+                bits.write(0, 1)
+
+            # Turn the matches into main tree elements, tracking the repeated offsets like the decoder
+            saved_offsets = (r0, r1, r2)
+            symbols = []
+            main_frequencies = [0] * self.main_elements
+            length_frequencies = [0] * LZX_NUM_SECONDARY_LENGTHS
+            for token in tokens:
+                if isinstance(token, int):
+                    symbols.append((token, None, 0, 0))
+                    main_frequencies[token] += 1
+                    continue
+
+                length, offset = token
+                if offset == r0:
+                    slot, extra, extra_bits = 0, 0, 0
+                elif offset == r1:
+                    slot, extra, extra_bits = 1, 0, 0
+                    r1, r0 = r0, offset
+                elif offset == r2:
+                    slot, extra, extra_bits = 2, 0, 0
+                    r2, r0 = r0, offset
+                else:
+                    formatted = offset + 2
+                    slot = bisect_right(LZX_POSITION_BASE, formatted) - 1
+                    extra_bits = LZX_EXTRA_BITS[slot]
+                    extra = formatted - LZX_POSITION_BASE[slot]
+                    r2, r1, r0 = r1, r0, offset
+
+                length_header = min(length - LZX_MIN_MATCH, LZX_NUM_PRIMARY_LENGTHS)
+                element = LZX_NUM_CHARS + (slot << 3) + length_header
+                length_footer = None
+                if length_header == LZX_NUM_PRIMARY_LENGTHS:
+                    length_footer = length - LZX_MIN_MATCH - LZX_NUM_PRIMARY_LENGTHS
+                    length_frequencies[length_footer] += 1
+                main_frequencies[element] += 1
+                symbols.append((element, length_footer, extra, extra_bits))
+
+            new_main_lengths = get_huffman_lengths(main_frequencies, 16)
+            new_length_lengths = get_huffman_lengths(length_frequencies, 16)
+            main_codes = get_huffman_codes(new_main_lengths)
+            length_codes = get_huffman_codes(new_length_lengths)
+
+            bits.write(LZX_BLOCKTYPE_VERBATIM, 3)
+            bits.write((frame_end - frame_start) >> 8, 16)
+            bits.write((frame_end - frame_start) & 0xFF, 8)
+            header_bits = bits.bit_length
+            write_tree_lengths(bits, main_lengths[:LZX_NUM_CHARS], new_main_lengths[:LZX_NUM_CHARS])
+            write_tree_lengths(bits, main_lengths[LZX_NUM_CHARS:], new_main_lengths[LZX_NUM_CHARS:])
+            write_tree_lengths(bits, length_lengths, new_length_lengths)
+            for element, length_footer, extra, extra_bits in symbols:
+                bits.write(main_codes[element], new_main_lengths[element])
+                if length_footer is not None:
+                    bits.write(length_codes[length_footer], new_length_lengths[length_footer])
+                if extra_bits:
+                    bits.write(extra, extra_bits)
+
+            if bits.bit_length - header_bits <= (frame_end - frame_start + 12) * 8:
+                main_lengths, length_lengths = new_main_lengths, new_length_lengths
+            else:
+                # Incompressible frame, store it and keep the previous trees for the next delta
+                r0, r1, r2 = saved_offsets
+                bits = BitWriter()
+                if frame_start == 0:
+                    bits.write(0, 1)
+                bits.write(LZX_BLOCKTYPE_UNCOMPRESSED, 3)
+                bits.write((frame_end - frame_start) >> 8, 16)
+                bits.write((frame_end - frame_start) & 0xFF, 8)
+                # The decoder skips a whole word when the header ends aligned
+                if bits.count == 0:
+                    bits.write(0, 16)
+                bits.align()
+                bits.out += struct.pack("<3I", r0, r1, r2)
+                bits.out += data[frame_start:frame_end]
+                if (frame_end - frame_start) & 1:
+                    bits.out += b"\x00"
+
+            bits.align()
+            frames.append(bytes(bits.out))
+
+        return frames
+
+
+class Cab:
+    """
+    In-process reader for Microsoft cabinets (stored, MSZIP and LZX folders),
+    folders are decoded on first access and kept in memory.
+    """
+
+    def __init__(self, data: Union[bytes, memoryview]) -> None:
+        self.data = memoryview(data)
+        (signature, _, self.size, _, files_offset, _, self.version_minor, self.version_major,
+         folder_count, file_count, self.flags, self.set_id, self.cabinet_index) = CAB_HEADER.unpack_from(self.data)
+
+        if signature != CAB_SIGNATURE:
+            raise ValueError("Not a cabinet file")
+        if self.flags & (FLAG_PREV_CABINET | FLAG_NEXT_CABINET):
+            raise ValueError("Cabinets spanning several files are not supported")
+
+        pos = CAB_HEADER.size
+        self.header_reserve = b""
+        self.folder_reserve_size = 0
+        self.data_reserve_size = 0
+        if self.flags & FLAG_RESERVE_PRESENT:
+            header_reserve_size, self.folder_reserve_size, self.data_reserve_size = struct.unpack_from("<HBB", self.data, pos)
+            pos += 4
+            self.header_reserve = bytes(self.data[pos:pos + header_reserve_size])
+            pos += header_reserve_size
+
+        self.folders: list[cab_folder] = []
+        for _ in range(folder_count):
+            self.folders.append(cab_folder(*CAB_FOLDER.unpack_from(self.data, pos)))
+            pos += CAB_FOLDER.size + self.folder_reserve_size
+
+        self.files: list[cab_file] = []
+        pos = files_offset
+        for _ in range(file_count):
+            size, folder_offset, folder_index, date, time_, attribs = CAB_FILE.unpack_from(self.data, pos)
+            pos += CAB_FILE.size
+            name_end = bytes(self.data[pos:pos + 0x200]).index(b"\x00")
+            raw_name = bytes(self.data[pos:pos + name_end])
+            pos += name_end + 1
+            name = raw_name.decode("utf-8" if attribs & ATTRIB_NAME_IS_UTF else "cp1252")
+            self.files.append(cab_file(name, size, folder_index, folder_offset, date, time_, attribs))
+
+        self._decoded: dict[int, bytes] = {}
+        self._folder_time: dict[int, float] = {}
+
+    @staticmethod
+    def from_path(path: Path) -> "Cab":
+        with open(path, "rb") as f:
+            return Cab(f.read())
+
+    def get_folder_blocks(self, folder: cab_folder) -> list[tuple[memoryview, int]]:
+        blocks = []
+        pos = folder.offset
+        for _ in range(folder.data_count):
+            _, compressed_size, uncompressed_size = CAB_DATA.unpack_from(self.data, pos)
+            pos += CAB_DATA.size + self.data_reserve_size
+            blocks.append((self.data[pos:pos + compressed_size], uncompressed_size))
+            pos += compressed_size
+        return blocks
+
+    def decode_folder(self, index: int) -> bytes:
+        if index in self._decoded:
+            return self._decoded[index]
+
+        folder = self.folders[index]
+        blocks = self.get_folder_blocks(folder)
+        compression = folder.compression & 0xF
+        start = time.perf_counter()
+
+        if compression == COMPRESS_NONE:
+            data = b"".join(blocks_data for blocks_data, _ in blocks)
+
+        elif compression == COMPRESS_MSZIP:
+            # Every block is its own deflate stream with the previous 32K as dictionary
+            out = bytearray()
+            for block, uncompressed_size in blocks:
+                if block[:2] != b"CK":
+                    raise ValueError("Invalid MSZIP block signature")
+                history = bytes(out[-MSZIP_WINDOW:])
+                decompressor = zlib.decompressobj(-15, zdict=history) if history else zlib.decompressobj(-15)
+                chunk = decompressor.decompress(block[2:]) + decompressor.flush()
+                if len(chunk) != uncompressed_size:
+                    raise ValueError("MSZIP block decoded to the wrong size")
+                out += chunk
+            data = bytes(out)
+
+        elif compression == COMPRESS_LZX:
+            window_bits = (folder.compression >> 8) & 0x1F
+            decoder = LzxDecoder(window_bits)
+            stream = b"".join(block for block, _ in blocks)
+            data = bytes(decoder.decompress(stream, sum(size for _, size in blocks)))
+
+        else:
+            raise ValueError(f"Unsupported cabinet compression type {compression}")
+
+        self._folder_time[index] = time.perf_counter() - start
+        self._decoded[index] = data
+        return data
+
+    def get_file(self, name: str) -> cab_file:
+        for file in self.files:
+            if file.name == name:
+                return file
+        raise KeyError(name)
+
+    def read(self, file: Union[str, cab_file]) -> memoryview:
+        if isinstance(file, str):
+            file = self.get_file(file)
+        folder_data = self.decode_folder(file.folder_index)
+        file.decode_time = self._folder_time[file.folder_index]
+        return memoryview(folder_data)[file.folder_offset:file.folder_offset + file.size]
+
+    def get_throughput(self) -> dict[str, float]:
+        # MB/s of the folder decode each file came out of
+        return {file.name: file.size / file.decode_time / 1e6
+                for file in self.files if file.decode_time > 0}
+
+
+def extract_cab_file(cab_file_path: Path, folder_path: Path, data=None, cache=None) -> Optional[dict[str, float]]:
 
     folder_path.mkdir(parents=True, exist_ok=True)
-    subprocess.run(['expand', cab_file_path, folder_path / f'{cab_file_path.stem}.dat'],
-                 stdout=subprocess.DEVNULL)
+    dat_path = folder_path / f'{cab_file_path.stem}.dat'
+
+    if data is None:
+        with open(cab_file_path, 'rb') as f:
+            data = f.read()
+
+    if cache is not None:
+        key = cache.get_key('cab', data)
+        entry = cache.get('cab', key)
+        if entry is not None:
+            cache.link(entry, 'dat', dat_path)
+            return None
+
+    # A hit from an earlier run may have left a link into the cache there
+    remove_file(dat_path)
+
+    # expand copies anything that is not a cabinet as is
+    if bytes(data[:4]) != CAB_SIGNATURE:
+        with open(dat_path, 'wb') as f:
+            f.write(data)
+        return None
+
+    cab = Cab(data)
+
+    # Same as expand, a single member cab is written under the cab name
+    if len(cab.files) == 1:
+        content = cab.read(cab.files[0])
+        with open(dat_path, 'wb') as f:
+            f.write(content)
+        if cache is not None:
+            cache.put('cab', key, {'dat': content})
+    else:
+        for file in cab.files:
+            output_path = folder_path / file.name.replace('\\', '/')
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            remove_file(output_path)
+            with open(output_path, 'wb') as f:
+                f.write(cab.read(file))
+
+    return cab.get_throughput()
+
+
+
+
+def get_cab_checksum(data: Union[bytes, memoryview], seed: int = 0) -> int:
+    # XOR of the little endian dwords, the 1-3 trailing bytes are packed first byte highest
+    words = len(data) >> 2
+    checksum = seed
+    if words:
+        checksum ^= int(np.bitwise_xor.reduce(np.frombuffer(data, dtype="<u4", count=words)))
+    tail = 0
+    for byte in bytes(data[words * 4:]):
+        tail = (tail << 8) | byte
+    return checksum ^ tail
+
+
+def compress_folder(data: bytes, compression: int, window_bits: int) -> list[tuple[bytes, int]]:
+    # (compressed block, uncompressed size) for every CFDATA of the folder
+    sizes = [min(LZX_FRAME_SIZE, len(data) - start) for start in range(0, len(data), LZX_FRAME_SIZE)]
+
+    if compression == COMPRESS_NONE:
+        return [(data[start:start + size], size) for start, size in zip(range(0, len(data), LZX_FRAME_SIZE), sizes)]
+
+    if compression == COMPRESS_MSZIP:
+        # Complete deflate stream per block, primed with the previous 32K like the decoder
+        blocks = []
+        for start, size in zip(range(0, len(data), LZX_FRAME_SIZE), sizes):
+            history = data[max(start - MSZIP_WINDOW, 0):start]
+            compressor = zlib.compressobj(1, zlib.DEFLATED, -15, zdict=history) if history \
+                else zlib.compressobj(1, zlib.DEFLATED, -15)
+            blocks.append((b"CK" + compressor.compress(data[start:start + size]) + compressor.flush(), size))
+        return blocks
+
+    if compression == COMPRESS_LZX:
+        return list(zip(LzxEncoder(window_bits).compress(data), sizes))
+
+    raise ValueError(f"Unsupported cabinet compression type {compression}")
+
+
+def build_cab(name: str, data: bytes, compression: int = COMPRESS_LZX, window_bits: int = GAME_LZX_WINDOW_BITS,
+              header_reserve: bytes = GAME_HEADER_RESERVE, set_id: int = GAME_SET_ID,
+              date: int = 0, time_: int = 0, attribs: int = 0x20) -> bytes:
+    blocks = compress_folder(data, compression, window_bits)
+    folder_compression = compression | (window_bits << 8) if compression == COMPRESS_LZX else compression
+    encoded_name = name.encode("cp1252") + b"\x00"
+
+    flags = FLAG_RESERVE_PRESENT if header_reserve else 0
+    header_size = CAB_HEADER.size + (4 + len(header_reserve) if header_reserve else 0)
+    files_offset = header_size + CAB_FOLDER.size
+    data_offset = files_offset + CAB_FILE.size + len(encoded_name)
+    total_size = data_offset + sum(CAB_DATA.size + len(block) for block, _ in blocks)
+
+    out = bytearray(CAB_HEADER.pack(CAB_SIGNATURE, 0, total_size, 0, files_offset, 0, 3, 1,
+                                    1, 1, flags, set_id, 0))
+    if header_reserve:
+        out += struct.pack("<HBB", len(header_reserve), 0, 0) + header_reserve
+    out += CAB_FOLDER.pack(data_offset, len(blocks), folder_compression)
+    out += CAB_FILE.pack(len(data), 0, 0, date, time_, attribs) + encoded_name
+
+    for block, uncompressed_size in blocks:
+        sizes = struct.pack("<HH", len(block), uncompressed_size)
+        out += struct.pack("<I", get_cab_checksum(sizes, get_cab_checksum(block))) + sizes + block
+    return bytes(out)
+
+
+def make_cab_file(file_path: Path, cab_path: Path, original: Union[Path, bytes, None] = None,
+                  compression: int = COMPRESS_LZX) -> int:
+    """
+    Cabs file_path into cab_path, the member name, window size, reserve and
+    set id are taken from the original cab when there is one.
+    Returns the size of the new cab.
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+
+    settings = {}
+    name = file_path.name
+    if original is not None:
+        if isinstance(original, Path):
+            original = original.read_bytes()
+        original_cab = Cab(original)
+        member = original_cab.files[0]
+        name = member.name
+        settings = {
+            "header_reserve": original_cab.header_reserve,
+            "set_id": original_cab.set_id,
+            "date": member.date,
+            "time_": member.time,
+            "attribs": member.attribs
+        }
+        if original_cab.folders[0].compression & 0xF == COMPRESS_LZX and compression == COMPRESS_LZX:
+            settings["window_bits"] = (original_cab.folders[0].compression >> 8) & 0x1F
+
+    cab = build_cab(name, data, compression, **settings)
+    cab_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(cab_path, 'wb') as f:
+        f.write(cab)
+    return len(cab)
 
 
-def make_cab_file(file_path):
-    t = 2
\ No newline at end of file
+def make_cab_files(jobs: list[tuple[Path, Path, Union[Path, bytes, None]]], workers: Optional[int] = None,
+                   compression: int = COMPRESS_LZX) -> list[int]:
+    # Each cab is independent, spread them over the cores
+    if len(jobs) == 0:
+        return []
+    file_paths, cab_paths, originals = zip(*jobs)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(make_cab_file, file_paths, cab_paths, originals, [compression] * len(jobs)))
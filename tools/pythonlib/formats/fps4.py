@@ -1,17 +1,20 @@
+import hashlib
+import mmap
 import shutil
 from dataclasses import dataclass
 import struct
-from typing import Optional
-from .FileIO import FileIO
+from typing import Optional, Union
+from .alldat import copy_range
 import os
 from pathlib import Path
-import subprocess
+from ..utils import lz77
+from ..utils.blob_cache import remove_file
 
 
 @dataclass
 class fps4_file():
     c_type:str
-    data:bytes
+    data:Union[bytes, memoryview]
     name:str
     size:int
     rank:int
@@ -24,188 +27,222 @@ dict_buffer = {
 
 class Fps4():
 
-    def __init__(self, header_path:Path , detail_path:Path = None, size_adjusted = 0) -> None:
+    def __init__(self, header_path:Path , detail_path:Path = None, size_adjusted = 0,
+                 header_data:bytes = None, detail_data:bytes = None) -> None:
         self.type = -1
         self.align = False
         self.files = []
         self.header_path = header_path
-        self.file_size = os.path.getsize(header_path)
         self.detail_path = detail_path or header_path
+        self._files = []
+        self._maps = []
+
+        # Archive is mapped (or served from memory, the paths are then only used for naming)
+        # and members are slices of it, nothing is read until it is used
+        self.header_view, header_file = self.open_view(header_path, header_data)
+        if detail_data is None and self.detail_path == header_path:
+            self.detail_view, self.detail_file = self.header_view, header_file
+        else:
+            self.detail_view, self.detail_file = self.open_view(self.detail_path, detail_data)
+        self.file_size = len(self.header_view)
         self.size_adjusted = size_adjusted
 
         self.extract_information()
 
+    def open_view(self, path:Path, data:bytes = None):
+        if data is not None:
+            return memoryview(data), None
+
+        file = open(path, "rb")
+        self._files.append(file)
+        if os.path.getsize(path) == 0:
+            return memoryview(b""), file
+        file_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(file_map)
+        return memoryview(file_map), file
+
+    def close(self) -> None:
+        for file in self.files:
+            if isinstance(file.data, memoryview):
+                file.data.release()
+        self.header_view.release()
+        self.detail_view.release()
+        for file_map in self._maps:
+            file_map.close()
+        for file in self._files:
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        return iter(self.files)
+
+    def __len__(self):
+        return len(self.files)
+
+    @property
+    def header_data(self) -> bytes:
+        # Only the packer needs the header as bytes, when it shares the file with the members
+        # that's the table and its closing entry
+        if self.detail_view is not self.header_view:
+            return bytes(self.header_view)
+        return bytes(self.header_view[:self.header_size + (self.file_amount + 1) * self.block_size])
+
     def extract_information(self):
-        with FileIO(self.header_path) as f_header:
-            self.header_data = f_header.read()
-            f_header.seek(4,0)
-            self.file_amount = f_header.read_uint32()-1
-            self.header_size = f_header.read_uint32()
-            self.offset = f_header.read_uint32()
-            self.block_size = f_header.read_uint16()
+        view = self.header_view
+        file_amount, self.header_size, self.offset = struct.unpack_from("<3I", view, 4)
+        self.file_amount = file_amount - 1
+        self.block_size = struct.unpack_from("<H", view, 0x10)[0]
+        self.first_offset = struct.unpack_from("<I", view, 0x1C)[0]
 
-            self.files = []
+        self.files = []
 
-            pos = f_header.tell()
-            f_header.seek(0x1C)
-            self.first_offset = f_header.read_uint32()
-            f_header.seek(pos)
+        if self.first_offset == 0:
+            if self.block_size == 0x2C:
+                self.read_more = True
+                self.extract_type1_fps4()
 
-            self.pack_file = self.pack_fps4_type1
+            elif self.block_size == 0x28:
+                self.read_more = False
+                self.extract_type1_fps4()
 
-            if self.first_offset == 0:
-                if self.block_size == 0x2C:
-                    self.read_more = True
-                    self.extract_type1_fps4(f_header=f_header)
+        else:
+            self.read_more = True
+            self.extract_type1_fps4()
 
-                elif self.block_size == 0x28:
-                    self.read_more = False
-                    self.extract_type1_fps4(f_header=f_header)
+    def pack_file(self, updated_file_path:Path, destination_folder:Path) -> int:
+        # A method rather than a bound one stored on self, that cycle kept the mapping alive
+        return self.pack_fps4_type1(updated_file_path, destination_folder)
 
-            else:
-                self.pack_file = self.pack_fps4_type1
-                self.read_more = True
-                self.extract_type1_fps4(f_header=f_header)
+    def get_c_type(self, data) -> str:
+        c_type = 'None'
+        if len(data) > 0:
+            if data[0] == 0x10:
+                c_type = 'LZ10'
+            elif data[0] == 0x11:
+                c_type = 'LZ11'
+        return c_type
 
     #Type 2 = Header with File offset
-    def extract_type2_fps4(self, f_header:FileIO):
+    def extract_type2_fps4(self):
 
         #Read all the files offsets
         files_offset = []
-        f_header.seek(self.header_size,0)
-        for _ in range(self.file_amount):
-            files_offset.append(f_header.read_uint32())
-            f_header.read(0x28)
+        for i in range(self.file_amount):
+            files_offset.append(struct.unpack_from("<I", self.header_view, self.header_size + i * 0x2C)[0])
 
         files_offset.append(self.file_size)
 
         #Create each file
         for i in range(len(files_offset)-1):
-            f_header.seek(files_offset[i], 0)
             size = files_offset[i+1] - files_offset[i]
-            data = f_header.read(size)
-            c_type = 'None'
-
-            if data[0] == 0x10:
-                c_type = 'LZ10'
-            elif data[0] == 0x11:
-                c_type = 'LZ11'
-
-            self.files.append(fps4_file(c_type, data, f'{i}.bin', size, i, files_offset[i]))
+            data = self.header_view[files_offset[i]:files_offset[i] + size]
+            self.files.append(fps4_file(self.get_c_type(data), data, f'{i}.bin', size, i, files_offset[i]))
 
 
     #Type 1 = Header + Detail
-    def extract_type1_fps4(self, f_header:FileIO):
+    def extract_type1_fps4(self):
         self.type = 1
-        files_infos = []
-        f_header.seek(self.header_size, 0)
-
-        with FileIO(self.detail_path) as det:
-            for _ in range(self.file_amount):
-                offset = f_header.read_uint32()
-                size = f_header.read_uint32()
+        entry_size = 0x2C if self.read_more else 0x28
 
-                if self.read_more:
-                    f_header.read_uint32()
-                name = f_header.read(32).decode("ASCII").strip('\x00')
-                files_infos.append((offset, size, name))
+        for i in range(self.file_amount):
+            entry = self.header_size + i * entry_size
+            offset, size = struct.unpack_from("<2I", self.header_view, entry)
+            name = bytes(self.header_view[entry + entry_size - 32:entry + entry_size]).decode("ASCII").strip('\x00')
 
-            i=0
-            for offset, size, name in files_infos:
-                #print(f'name: {name} - size: {size}')
+            data = self.detail_view[offset:offset + size]
+            self.files.append(fps4_file(self.get_c_type(data), data, name, size, i, offset))
 
-                det.seek(offset)
-                data = det.read(size)
-
-                c_type = 'None'
-                if data[0] == 0x10:
-                    c_type = 'LZ10'
-                elif data[0] == 0x11:
-                    c_type = 'LZ11'
-
-                self.files.append(fps4_file(c_type, data, name, size, i, offset))
-                i+=1
-
-    def extract_files(self, destination_path:Path, copy_path:Path, decompressed=False):
+    def extract_files(self, destination_path:Path, copy_path:Path, decompressed=False, cache=None):
 
         destination_path.mkdir(parents=True, exist_ok=True)
-        for file in self.files:
-
-            copy_path.mkdir(parents=True, exist_ok=True)
-            with open(destination_path / file.name, "wb") as f:
-                f.write(file.data)
-
-            shutil.copy(destination_path / file.name, copy_path / file.name)
-
-            #Decompress using LZ10 or LZ11
-            if file.c_type == "LZ10":
-                args = [Path.cwd() / 'tools/pythonlib/utils/lzss', '-d', destination_path / file.name]
-                subprocess.run(args, stdout = subprocess.DEVNULL)
-
-            elif file.c_type == "LZ11":
-                args = [Path.cwd() / 'tools/pythonlib/utils/lzx', '-d', destination_path / file.name]
-                subprocess.run(args, stdout=subprocess.DEVNULL)
-
-            with open(destination_path / file.name, 'rb') as f:
-                head = f.read(4)
-
-                if head == b'FPS4':
-                    file.file_extension = 'FPS4'
-                elif head[:-1] == b'TSS':
-                    file.file_extension = 'TSS'
-
-    def compress_file(self, updated_file_path:Path, file_name:str, c_type:str):
-        args = []
-        if c_type == 'LZ10':
-            args = [Path.cwd() / 'tools/pythonlib/utils/lzss', '-evn', updated_file_path / file_name]
-        elif c_type == "LZ11":
-            args = [Path.cwd() / 'tools/pythonlib/utils/lzx', '-evb', updated_file_path / file_name]
-        subprocess.run(args, stdout = subprocess.DEVNULL)
-
-    def pack_fps4_type1(self, updated_file_path:Path, destination_folder:Path):
-        buffer = 0
-
-        #Update detail file
-        self.files.sort(key= lambda file: file.offset)
-
-        with FileIO(destination_folder / self.detail_path.name, "wb") as fps4_detail:
-
-            #Writing new dat file and updating file attributes
+        copy_path.mkdir(parents=True, exist_ok=True)
+
+        entry = None
+        if cache is not None:
+            names = '/'.join(file.name for file in self.files).encode()
+            key = cache.get_key('fps4', names, *[file.data for file in self.files])
+            entry = cache.get('fps4', key)
+            if entry is not None:
+                for file in self.files:
+                    cache.link(entry, file.name, destination_path / file.name)
+                    self.set_file_extension(file, self.get_head(file, destination_path / file.name))
+
+        if entry is None:
+            # Members are decompressed in memory, the header is sniffed before anything is written
+            members = {}
             for file in self.files:
+                members[file.name] = self.decompress_file(file)
+                self.set_file_extension(file, members[file.name][:4])
+
+            if cache is not None:
+                # Written once in the cache, the destination links to it
+                entry = cache.put('fps4', key, members)
+                for file in self.files:
+                    cache.link(entry, file.name, destination_path / file.name)
+            else:
+                for name, data in members.items():
+                    remove_file(destination_path / name)
+                    with open(destination_path / name, "wb") as f:
+                        f.write(data)
 
-                #self.compress_file(updated_file_path, file_name=file.name, c_type=file.c)
-
-                with FileIO(updated_file_path / file.name, 'rb') as sub_file:
-                    file.data = sub_file.read()
-                    file.offset = buffer
-                    file.size = len(file.data)
-                    buffer += file.size
-                    fps4_detail.write(file.data)
-
-        #Update header file
-        with FileIO(self.header_data, "r+b") as fps4_header:
-
-            fps4_header.seek(self.header_size,0)
-            self.files.sort(key= lambda file: file.rank)
-            for file in self.files:
-                fps4_header.write(struct.pack('<L', file.offset))
-                fps4_header.write(struct.pack('<L', file.size))
-
-                if self.read_more:
-                    fps4_header.seek(fps4_header.tell()+4,0)
-                    #fps4_header.write(struct.pack('<L', file.size))
-
-                fps4_header.write(file.name.encode())
-                fps4_header.write(b'\x00' * (32 - (len(file.name) % 32)))
+        #The mirror keeps the members as they are in the archive
+        for file in self.files:
+            with open(copy_path / file.name, "wb") as f:
+                f.write(file.data)
 
-            fps4_header.write(struct.pack('<L', buffer) + b'\x00' * 12)
+    def get_head(self, file:fps4_file, decompressed_path:Path) -> bytes:
+        if file.c_type == 'None':
+            return file.data[:4]
+        with open(decompressed_path, "rb") as f:
+            return f.read(4)
+
+    def set_file_extension(self, file:fps4_file, head:bytes):
+        if head == b'FPS4':
+            file.file_extension = 'FPS4'
+        elif head[:-1] == b'TSS':
+            file.file_extension = 'TSS'
+
+    def decompress_file(self, file:fps4_file) -> bytes:
+        # The type only comes from the first byte, data that doesn't decode is kept as is like lzss/lzx did
+        if file.c_type in ('LZ10', 'LZ11'):
+            try:
+                return lz77.decompress(file.data)
+            except ValueError:
+                pass
+        return file.data
+
+    def compress_file(self, updated_file_path:Path, file_name:str, c_type:str) -> bytes:
+        with open(updated_file_path / file_name, 'rb') as f:
+            data = f.read()
+
+        if c_type in ('LZ10', 'LZ11'):
+            data = lz77.compress(data, c_type)
+        return data
+
+    def is_same(self, data:bytes, original:bytes) -> bool:
+        return len(data) == len(original) and hashlib.sha1(data).digest() == hashlib.sha1(original).digest()
+
+    def pack_fps4_type1(self, updated_file_path:Path, destination_folder:Path) -> int:
+
+        #Only members that differ from the archive are kept, the others reuse the original bytes
+        updated = {}
+        for file in self.files:
+            file_path = updated_file_path / file.name
+            if not file_path.exists():
+                continue
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            if not self.is_same(data, file.data):
+                updated[file.name] = data
 
-            with FileIO(destination_folder / self.header_path.name, "wb") as f_header:
-                fps4_header.seek(0,0)
-                f_header.write(fps4_header.read())
+        return self.write_fps4(updated, destination_folder)
 
-    def pack_fps4_bg(self, updated_file_path:Path, destination_folder:Path):
-        buffer = 0
+    def pack_fps4_bg(self, updated_file_path:Path, destination_folder:Path) -> int:
 
         #Update detail file
         map = {
@@ -221,48 +258,114 @@ class Fps4():
         shutil.copytree(src=Path.cwd() / '2_translated' / 'menu_bg', dst=updated_file_path, dirs_exist_ok=True)
         new_files = [ele.name for ele in updated_file_path.iterdir()]
 
-        self.files.sort(key= lambda file: file.offset)
-        with FileIO(destination_folder / self.detail_path.name, "wb") as fps4_detail:
-
-            #Writing new dat file and updating file attributes
-            for file in self.files:
-                file_split = file.name.split('.')
-
-                if file_split[1] in map.keys():
-                    new = file_split[0] + f'.{map[file_split[1]]}'
-
-                    if new in new_files:
-                        self.compress_file(updated_file_path, file_name=new, c_type=file.c_type)
-                        with FileIO(updated_file_path / new, 'rb') as sub_file:
-                            file.data = sub_file.read()
-
-                file.offset = buffer
-                file.size = len(file.data)
-                buffer += file.size
-                fps4_detail.write(file.data)
-
-        #Update header file
-        with FileIO(self.header_data, "r+b") as fps4_header:
-
-            fps4_header.seek(self.header_size,0)
-            self.files.sort(key= lambda file: file.rank)
-            for file in self.files:
-                fps4_header.write(struct.pack('<L', file.offset))
-                fps4_header.write(struct.pack('<L', file.size))
+        updated = {}
+        for file in self.files:
+            file_split = file.name.split('.')
+
+            if file_split[1] in map.keys():
+                new = file_split[0] + f'.{map[file_split[1]]}'
+
+                if new in new_files:
+                    #Compared decompressed, an unchanged graphic isn't encoded again
+                    with open(updated_file_path / new, 'rb') as f:
+                        data = f.read()
+                    if not self.is_same(data, self.decompress_file(file)):
+                        updated[file.name] = self.compress_file(updated_file_path, file_name=new, c_type=file.c_type)
+
+        return self.write_fps4(updated, destination_folder)
+
+    def write_fps4(self, updated:dict, destination_folder:Path) -> int:
+        """
+        Streams the detail file in offset order and writes the header. Members keep their
+        offset while everything before them does and a changed one still fits the space up
+        to the next member, runs of original bytes are copied in one go.
+        Returns the amount of bytes rewritten.
+        """
+        detail_path = destination_folder / self.detail_path.name
+        header_path = destination_folder / self.header_path.name
+        for path in (detail_path, header_path):
+            if path.exists() and any(os.path.samefile(path, source.name) for source in self._files):
+                raise ValueError("Fps4 can't be packed over the archive it is read from")
+
+        #A member can use the space up to the next one
+        files = sorted(self.files, key= lambda file: file.offset)
+        ends = [file.offset for file in files[1:]]
+        if files:
+            ends.append(max(len(self.detail_view), files[-1].offset + files[-1].size))
+        source_fd = self.detail_file.fileno() if self.detail_file is not None else None
+
+        written = 0
+        buffer = 0
+        #Range of the original waiting to be copied
+        copy_start = copy_end = 0
+
+        with open(detail_path, "wb", buffering=0) as fps4_detail:
+
+            def flush_copy():
+                if copy_end > copy_start:
+                    if source_fd is not None:
+                        copy_range(source_fd, fps4_detail, copy_start, copy_end - copy_start, self.detail_view)
+                    else:
+                        fps4_detail.write(self.detail_view[copy_start:copy_end])
+
+            for file, end in zip(files, ends):
+                data = updated.get(file.name)
+                in_place = buffer <= file.offset
+
+                if data is None and in_place:
+                    #Same offset, the gap before it comes along with the run
+                    if copy_end != buffer:
+                        flush_copy()
+                        copy_start = buffer
+                    copy_end = file.offset + file.size
+                    buffer = copy_end
+
+                elif data is None:
+                    #Moved by a member before it that grew
+                    if copy_end != file.offset:
+                        flush_copy()
+                        copy_start = file.offset
+                    copy_end = file.offset + file.size
+                    file.offset = buffer
+                    buffer += file.size
+                    written += file.size
+
+                else:
+                    if in_place:
+                        #Gap up to the original offset is kept so the slot doesn't move
+                        if copy_end != buffer:
+                            flush_copy()
+                            copy_start = buffer
+                        copy_end = file.offset
+                        buffer = file.offset
+                    flush_copy()
+                    copy_start = copy_end = 0
+
+                    fps4_detail.write(data)
+                    file.offset = buffer
+                    file.size = len(data)
+                    file.data = data
+                    buffer += len(data)
+                    written += len(data)
 
-                if self.read_more:
-                    fps4_header.seek(fps4_header.tell()+4,0)
-                    #fps4_header.write(struct.pack('<L', file.size))
+                    #Padded to the next member when it fits so the rest keeps its offsets
+                    if in_place and buffer < end:
+                        fps4_detail.write(b'\x00' * (end - buffer))
+                        buffer = end
 
-                fps4_header.write(file.name.encode())
-                fps4_header.write(b'\x00' * (32 - (len(file.name) % 32)))
+            flush_copy()
 
-            fps4_header.write(struct.pack('<L', buffer) + b'\x00' * 12)
+        #Update header file, only offsets and sizes change
+        header = bytearray(self.header_data)
+        entry_size = 0x2C if self.read_more else 0x28
+        for file in self.files:
+            struct.pack_into('<2L', header, self.header_size + file.rank * entry_size, file.offset, file.size)
+        struct.pack_into('<L12x', header, self.header_size + len(self.files) * entry_size, buffer)
 
-            with FileIO(destination_folder / self.header_path.name, "wb") as f_header:
-                fps4_header.seek(0,0)
-                f_header.write(fps4_header.read())
+        with open(header_path, "wb") as f_header:
+            f_header.write(header)
 
+        return written
 
     def get_file_extension(self, file_path:Path):
 
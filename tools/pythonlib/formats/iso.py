@@ -0,0 +1,263 @@
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+import pycdlib
+from tqdm import tqdm
+
+SECTOR_SIZE = 0x800
+COPY_CHUNK = 0x400000
+
+
+@dataclass
+class iso_file:
+    iso_path: str
+    path: str
+    lba: int
+    size: int
+    hash: str = ""
+    record: int = 0
+
+
+def read_iso_files(umd_iso: Path) -> list[iso_file]:
+    iso = pycdlib.PyCdlib()
+    iso.open(str(umd_iso))
+
+    files = []
+    with open(umd_iso, "rb") as raw:
+        for dirname, _, filelist in iso.walk(iso_path="/"):
+            directory = iso.get_record(iso_path=dirname)
+            raw.seek(directory.extent_location() * SECTOR_SIZE)
+            directory_data = raw.read(directory.get_data_length())
+
+            for name in filelist:
+                iso_path = dirname.rstrip("/") + "/" + name
+                record = iso.get_record(iso_path=iso_path)
+                record_offset = directory.extent_location() * SECTOR_SIZE + find_record(directory_data, name)
+                files.append(iso_file(iso_path, iso_path[1:].split(";")[0],
+                                      record.extent_location(), record.get_data_length(), record=record_offset))
+
+    iso.close()
+    return files
+
+
+def find_record(directory_data: bytes, name: str) -> int:
+    identifier = name.encode("ascii")
+    pos = 0
+    while pos < len(directory_data):
+        length = directory_data[pos]
+
+        # Records never cross a sector boundary, the rest of the sector is padding
+        if length == 0:
+            pos = (pos // SECTOR_SIZE + 1) * SECTOR_SIZE
+            continue
+
+        name_length = directory_data[pos + 32]
+        if directory_data[pos + 33:pos + 33 + name_length] == identifier:
+            return pos
+        pos += length
+
+    raise ValueError(f"Directory record for {name} not found")
+
+
+def write_both_endian(f, offset: int, value: int) -> None:
+    f.seek(offset)
+    f.write(struct.pack("<I", value) + struct.pack(">I", value))
+
+
+def copy_extent(src, dest, offset: int, size: int, buffer: bytearray, progress=None) -> str:
+    src.seek(offset)
+    view = memoryview(buffer)
+    digest = hashlib.sha1()
+    while size > 0:
+        read = src.readinto(view[:min(size, len(buffer))])
+        if read == 0:
+            raise EOFError(f"Unexpected end of ISO at 0x{src.tell():X}")
+        digest.update(view[:read])
+        if dest is not None:
+            dest.write(view[:read])
+        size -= read
+        if progress is not None:
+            progress(read)
+    return digest.hexdigest()
+
+
+def get_iso_fingerprint(umd_iso: Path) -> dict:
+    stat = os.stat(umd_iso)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def load_iso_manifest(manifest_path: Path) -> Optional[dict]:
+    if not manifest_path.exists():
+        return None
+
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_iso_manifest(manifest_path: Path, umd_iso: Path, files: list[iso_file]) -> None:
+    manifest = {
+        "path": str(umd_iso),
+        "iso": get_iso_fingerprint(umd_iso),
+        "files": {file.path: {"lba": file.lba, "size": file.size, "hash": file.hash} for file in files}
+    }
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+
+
+def get_changed_files(umd_iso: Path, files: list[iso_file], extract_to: Path, manifest: dict) -> list[iso_file]:
+    same_iso = manifest["iso"] == get_iso_fingerprint(umd_iso)
+    buffer = bytearray(COPY_CHUNK)
+    changed = []
+
+    with open(umd_iso, "rb") as src:
+        for file in files:
+            previous = manifest["files"].get(file.path)
+            dest = extract_to / file.path
+
+            if previous is None or not dest.exists() or dest.stat().st_size != file.size:
+                changed.append(file)
+                continue
+
+            # Same disc and same extent, nothing can have moved
+            if same_iso and previous["lba"] == file.lba and previous["size"] == file.size:
+                file.hash = previous["hash"]
+                continue
+
+            # Revised disc, only rewrite when the content really differs
+            file.hash = copy_extent(src, None, file.lba * SECTOR_SIZE, file.size, buffer)
+            if file.hash != previous["hash"]:
+                changed.append(file)
+
+    # Files that disappeared from the disc
+    paths = {file.path for file in files}
+    for path in manifest["files"]:
+        if path not in paths:
+            (extract_to / path).unlink(missing_ok=True)
+
+    return changed
+
+
+def extract_iso_files(umd_iso: Path, files: list[iso_file], extract_to: Path, workers: int = 8) -> dict[str, float]:
+
+    # Create the folders once, the workers only open files
+    for folder in {(extract_to / file.path).parent for file in files}:
+        folder.mkdir(parents=True, exist_ok=True)
+
+    lock = threading.Lock()
+    local = threading.local()
+    timings: dict[str, float] = {}
+
+    # Largest files first so all.dat does not end up alone at the end
+    files = sorted(files, key=lambda file: file.size, reverse=True)
+
+    with tqdm(total=sum(file.size for file in files), desc="Extracting ISO", unit="B",
+              unit_divisor=1024, unit_scale=True) as pbar:
+
+        def update(n: int):
+            with lock:
+                pbar.update(n)
+
+        def extract(file: iso_file):
+            if not hasattr(local, "buffer"):
+                local.buffer = bytearray(COPY_CHUNK)
+
+            start = time.perf_counter()
+            with open(umd_iso, "rb") as src, open(extract_to / file.path, "wb") as dest:
+                file.hash = copy_extent(src, dest, file.lba * SECTOR_SIZE, file.size, local.buffer, update)
+            timings[file.path] = time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(extract, files))
+
+    return timings
+
+
+def load_build_manifest(manifest_path: Path) -> Optional[dict]:
+    return load_iso_manifest(manifest_path)
+
+
+def save_build_manifest(manifest_path: Path, manifest: dict) -> None:
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+
+
+def new_build_manifest(umd_iso: Path, build_name: str) -> dict:
+    return {
+        "iso": get_iso_fingerprint(umd_iso),
+        "build": build_name,
+        "end": os.path.getsize(umd_iso) // SECTOR_SIZE,
+        "files": {}
+    }
+
+
+def hash_file(path: Path, buffer: bytearray) -> str:
+    with open(path, "rb") as f:
+        return copy_extent(f, None, 0, os.path.getsize(path), buffer)
+
+
+def patch_iso(build_iso: Path, umd_iso: Path, files: list[iso_file], patched: dict[str, Path], manifest: dict) -> int:
+    """
+    Patches the files of build_iso in place, manifest keeps track of
+    every file that no longer matches the original UMD.
+    Returns the amount of bytes written.
+    """
+    buffer = bytearray(COPY_CHUNK)
+    written = 0
+
+    with open(build_iso, "r+b") as out, open(umd_iso, "rb") as src:
+        for file in files:
+            patch = patched.get(file.path.lower())
+            current = manifest["files"].get(file.path)
+            original_alloc = (file.size + SECTOR_SIZE - 1) // SECTOR_SIZE
+
+            # File is back to its original content
+            if patch is None:
+                if current is not None:
+                    out.seek(file.lba * SECTOR_SIZE)
+                    copy_extent(src, out, file.lba * SECTOR_SIZE, original_alloc * SECTOR_SIZE, buffer)
+                    write_both_endian(out, file.record + 2, file.lba)
+                    write_both_endian(out, file.record + 10, file.size)
+                    del manifest["files"][file.path]
+                    written += original_alloc * SECTOR_SIZE
+                continue
+
+            patch_hash = hash_file(patch, buffer)
+            if current is not None and current["hash"] == patch_hash:
+                continue
+
+            size = os.path.getsize(patch)
+            alloc = (size + SECTOR_SIZE - 1) // SECTOR_SIZE
+
+            # Reuse the original extent, then the relocated one, else move to the end of the image
+            if alloc <= original_alloc:
+                lba, alloc = file.lba, original_alloc
+            elif current is not None and alloc <= current["alloc"]:
+                lba, alloc = current["lba"], current["alloc"]
+            else:
+                lba = manifest["end"]
+                manifest["end"] += alloc
+                tqdm.write(f"{file.path} grew, relocating it to LBA {lba}")
+
+            out.seek(lba * SECTOR_SIZE)
+            with open(patch, "rb") as f:
+                copy_extent(f, out, 0, size, buffer)
+            out.write(b"\x00" * (alloc * SECTOR_SIZE - size))
+
+            write_both_endian(out, file.record + 2, lba)
+            write_both_endian(out, file.record + 10, size)
+            manifest["files"][file.path] = {"lba": lba, "size": size, "alloc": alloc, "hash": patch_hash}
+            written += alloc * SECTOR_SIZE
+
+        # Volume space size of the primary volume descriptor
+        write_both_endian(out, 16 * SECTOR_SIZE + 80, manifest["end"])
+        out.truncate(manifest["end"] * SECTOR_SIZE)
+
+    return written
@@ -1,7 +1,8 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import mmap
 import struct
-from typing import Optional
-from .FileIO import FileIO
+from pathlib import Path
+from typing import Optional, Union
 from ..utils import comptolib
 
 
@@ -9,7 +10,47 @@ from ..utils import comptolib
 class pak_file:
     is_compressed: bool
     type: int
-    data: bytes
+    raw: Union[bytes, memoryview]
+    decompressed: Optional[Union[bytes, memoryview]] = field(default=None, repr=False)
+    cache: object = field(default=None, repr=False, compare=False)
+    # Set once data is replaced, clean entries are written back from raw as is
+    dirty: bool = False
+
+    @property
+    def data(self) -> Union[bytes, memoryview]:
+        # Decompressed on first access, uncompressed entries are the slice itself
+        if self.decompressed is None:
+            if not self.is_compressed:
+                self.decompressed = self.raw
+            elif not self.load_cached():
+                self.set_decompressed(comptolib.decompress_data(self.raw))
+        return self.decompressed
+
+    def load_cached(self) -> bool:
+        if self.cache is None:
+            return False
+        entry = self.cache.get("compto", self.cache.get_key("compto", self.raw))
+        if entry is None:
+            return False
+        self.decompressed = self.cache.read(entry, "data")
+        return True
+
+    def set_decompressed(self, data: bytes) -> None:
+        self.decompressed = data
+        if self.cache is not None:
+            self.cache.put("compto", self.cache.get_key("compto", self.raw), {"data": data})
+
+    @data.setter
+    def data(self, value: bytes) -> None:
+        self.decompressed = value
+        self.dirty = True
+
+    def get_blob(self, level: str = "release") -> Union[bytes, memoryview]:
+        if not self.dirty:
+            return self.raw
+        if self.is_compressed:
+            return comptolib.compress_data(self.data, version=self.type, level=level)
+        return self.data
 
 
 class Pak:
@@ -17,67 +58,89 @@ class Pak:
         self.type = -1
         self.align = False
         self.files = []
+        self.offsets: list[int] = []
+        self.sizes: list[int] = []
+        # Serialized Pak that patch_entry edits in place, built on the first patch
+        self.image: Optional[bytearray] = None
+        self._file = None
+        self._map = None
+        self._view = None
 
     @staticmethod
-    def from_path(path, type) -> "Pak":
-        with FileIO(path) as f:
-            self = Pak()
-            if type != -1:
-                self.type = type
-
-            file_amount = f.read_uint32()
-            self.files = []
-            blobs: list[bytes] = []
-            offsets: list[int] = []
-            sizes: list[int] = []
-
-            # Pak0
-            if type == 0:
-                for _ in range(file_amount):
-                    sizes.append(f.read_uint32())
-
-                for size in sizes:
-                    blobs.append(f.read(size))
-
-            # Pak1
-            elif type == 1:
-                for _ in range(file_amount):
-                    offsets.append(f.read_uint32())
-                    sizes.append(f.read_uint32())
-
-                for offset, size in zip(offsets, sizes):
-                    f.seek(offset)
-                    blobs.append(f.read(size))
-            # Pak3
-            elif type == 3:
-                for _ in range(file_amount):
-                    offsets.append(f.read_uint32())
-                f.seek(0, 2)
-                offsets.append(f.tell())
-                for i, j in zip(offsets[::1], offsets[1::1]):
-                    sizes.append(j - i)
-                for offset, size in zip(offsets, sizes):
-                    f.seek(offset)
-                    blobs.append(f.read(size))
-
-            for off in offsets:
-                if off % 0x10 == 0:
-                    self.align = True
-                break
+    def from_path(path, type, cache=None) -> "Pak":
+        self = Pak()
+
+        # Members are slices of the mapping, nothing is read or decompressed until it is used
+        if isinstance(path, (bytes, bytearray, memoryview)):
+            self._view = memoryview(path)
+        else:
+            self._file = open(path, "rb")
+            if Path(path).stat().st_size > 0:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._map)
+            else:
+                self._view = memoryview(b"")
+
+        if type == -1:
+            type = Pak.get_pak_type(self._view)
+            if type is None:
+                raise ValueError("Unknown PAK type")
+        self.type = type
 
-        for blob in blobs:
+        for blob in self.get_blobs():
             is_compressed = comptolib.is_compressed(blob)
-            c_type = 0
-            if is_compressed:
-                c_type = blob[0]
-                blob = comptolib.decompress_data(blob)
+            self.files.append(pak_file(is_compressed, blob[0] if is_compressed else 0, blob, cache=cache))
+        return self
+
+    def get_blobs(self) -> list[memoryview]:
+        view = self._view
+        file_amount = struct.unpack_from("<I", view)[0]
+        offsets: list[int] = []
+        sizes: list[int] = []
 
-            self.files.append(pak_file(is_compressed, c_type, blob))
+        # Pak0
+        if self.type == 0:
+            sizes = list(struct.unpack_from(f"<{file_amount}I", view, 4))
+            offset = 4 + 4 * file_amount
+            for size in sizes:
+                offsets.append(offset)
+                offset += size
+
+        # Pak1
+        elif self.type == 1:
+            table = struct.unpack_from(f"<{file_amount * 2}I", view, 4)
+            offsets, sizes = list(table[0::2]), list(table[1::2])
+            self.align = len(offsets) > 0 and offsets[0] % 0x10 == 0
 
+        # Pak3
+        elif self.type == 3:
+            offsets = list(struct.unpack_from(f"<{file_amount}I", view, 4))
+            sizes = [j - i for i, j in zip(offsets, offsets[1:] + [len(view)])]
+            self.align = len(offsets) > 0 and offsets[0] % 0x10 == 0
+
+        self.offsets, self.sizes = offsets, sizes
+        return [view[offset:offset + size] for offset, size in zip(offsets, sizes)]
+
+    def close(self) -> None:
+        for file in self.files:
+            if isinstance(file.raw, memoryview):
+                file.raw.release()
+        if self._view is not None:
+            self._view.release()
+        if self._map is not None:
+            self._map.close()
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
         return self
 
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     @staticmethod
-    def get_pak_type(data: bytes) -> Optional[int]:
+    def get_pak_type(data) -> Optional[int]:
+        # Only the header is looked at, data can be a whole file mapping
         is_aligned = False
 
         data_size = len(data)
@@ -90,6 +153,8 @@ class Pak:
         # Expectations
         pak1_header_size = 4 + (files * 8)
         pak3_header_size = 4 + (files * 4)
+        if pak3_header_size > data_size:
+            return None
 
         # Check for alignment
         if first_entry % 0x10 == 0:
@@ -130,65 +195,149 @@ class Pak:
             return 3
         return None
 
-    def to_bytes(self, type=-1) -> bytes:
-        compose_mode = type if type != -1 else self.type
-        if compose_mode == -1:
-            raise ValueError("Trying to compose an invalid PAK type")
-
-        # Collect blobs
-        blobs = []
-        for blob in self.files:
-            if blob.is_compressed:
-                blobs.append(comptolib.compress_data(blob.data, version=blob.type))
-            else:
-                blobs.append(blob.data)
-
-        # Compose
-        out = struct.pack("<I", len(self.files))
+    def get_header_size(self, compose_mode: int) -> int:
+        return 4 + (8 if compose_mode == 1 else 4) * len(self.files)
 
-        # Pak0
+    def pack_header(self, compose_mode: int) -> bytes:
         if compose_mode == 0:
-            for blob in blobs:
-                out += struct.pack("<I", len(blob))
-        # Pak1
+            table = self.sizes
         elif compose_mode == 1:
-            offset = 4 + (8 * len(blobs))
-            sizes = [0] + list([len(x) for x in blobs])
-            if self.align:
-                offset = (offset + 0xF) & ~0xF
-
-            for i, j in zip(sizes[::1], sizes[1::1]):
-                if self.align:
-                    i = (i + 0xF) & ~0xF
-                out += struct.pack("<I", offset + i)
-                out += struct.pack("<I", j)
-                offset += i
-        # Pak3
+            table = [value for pair in zip(self.offsets, self.sizes) for value in pair]
         elif compose_mode == 3:
-            offset = 4 + (4 * len(blobs))
-            if self.align:
-                offset = (offset + 0xF) & ~0xF
+            table = self.offsets
+        else:
+            raise ValueError("Trying to compose an invalid PAK type")
+        return struct.pack(f"<I{len(table)}I", len(self.files), *table)
 
-            cur = offset
-            for blob in blobs:
-                out += struct.pack("<I", cur)
-                cur += len(blob)
-                if self.align:
-                    cur = (cur + 0xF) & ~0xF
+    def decompress_all(self) -> None:
+        # Decodes every compressed member that wasn't read yet in one parallel batch
+        pending = [file for file in self.files
+                   if file.is_compressed and file.decompressed is None and not file.load_cached()]
+        for file, data in zip(pending, comptolib.decompress_many([file.raw for file in pending])):
+            file.set_decompressed(data)
+
+    @staticmethod
+    def compress_dirty(paks: list["Pak"], level: str = "release") -> None:
+        # Modified members of every pak are compressed in one parallel batch and become clean again
+        pending = [file for pak in paks for file in pak.files if file.dirty and file.is_compressed]
+        blobs = comptolib.compress_many([file.data for file in pending],
+                                        versions=[file.type for file in pending], level=level)
+        for file, blob in zip(pending, blobs):
+            file.raw = blob
+            file.dirty = False
+
+    def write_blobs(self, write, compose_mode: int, level: str) -> None:
+        # Lays the blobs out one after the other, the table is only known once they are all written
+        pos = self.get_header_size(compose_mode)
+        self.offsets = []
+        self.sizes = []
+        Pak.compress_dirty([self], level)
+        for file in self.files:
+            blob = file.get_blob(level)
 
-        # add files
-        for blob in blobs:
             if self.align:
-                out += b"\x00" * (((len(out) + 0xF) & ~0xF) - len(out))
-            out += blob
+                padding = ((pos + 0xF) & ~0xF) - pos
+                write(b"\x00" * padding)
+                pos += padding
 
-        return out
+            self.offsets.append(pos)
+            self.sizes.append(len(blob))
+            write(blob)
+            pos += len(blob)
 
-    def replace_tss(self, tss_data:bytes):
+    def get_compose_mode(self, type: int) -> int:
+        compose_mode = type if type != -1 else self.type
+        if compose_mode not in (0, 1, 3):
+            raise ValueError("Trying to compose an invalid PAK type")
+        return compose_mode
+
+    def get_image(self, compose_mode: int) -> Optional[bytearray]:
+        # The patched image is only current while every change went through patch_entry
+        if self.image is not None and (compose_mode != self.type or any(file.dirty for file in self.files)):
+            self.image = None
+        return self.image
+
+    def patch_entry(self, index: int, data: bytes, level: str = "release") -> None:
+        """
+        Replaces one member straight in the serialized Pak. When the member
+        still fits its slot only that region is overwritten, otherwise the
+        bytes after it move and only the following table entries change.
+        """
+        if self.get_image(self.type) is None:
+            self.image = self.to_bytes(level=level)
+        image = self.image
+
+        file = self.files[index]
+        file.data = data
+        file.raw, file.dirty = file.get_blob(level), False
+        size = len(file.raw)
+
+        last = index == len(self.files) - 1
+        offset = self.offsets[index]
+        end = len(image) if last else self.offsets[index + 1]
+        needed = size
+        if self.align and not last:
+            needed = ((offset + size + 0xF) & ~0xF) - offset
+
+        # Pak1 has the sizes in its table so a member can shrink in place,
+        # Pak0 and Pak3 get them from the layout so the slot has to match
+        if needed == end - offset or (self.type == 1 and needed <= end - offset):
+            image[offset:offset + size] = file.raw
+            image[offset + size:end] = bytes(end - offset - size)
+        else:
+            image[offset:end] = bytes(file.raw) + bytes(needed - size)
+            delta = needed - (end - offset)
+            for following in range(index + 1, len(self.offsets)):
+                self.offsets[following] += delta
+
+        if self.type == 0:
+            self.sizes[index] = size
+            struct.pack_into("<I", image, 4 + 4 * index, size)
+        elif self.type == 1:
+            self.sizes[index] = size
+            table = [value for pair in zip(self.offsets[index:], self.sizes[index:]) for value in pair]
+            struct.pack_into(f"<{len(table)}I", image, 4 + 8 * index, *table)
+        else:
+            self.sizes[index] = needed
+            struct.pack_into(f"<{len(self.offsets) - index}I", image, 4 + 4 * index, *self.offsets[index:])
+
+    def to_bytes(self, type=-1, level="release") -> bytearray:
+        compose_mode = self.get_compose_mode(type)
+        if self.get_image(compose_mode) is not None:
+            return bytearray(self.image)
+
+        header_size = self.get_header_size(compose_mode)
+        out = bytearray(header_size)
+        self.write_blobs(out.extend, compose_mode, level)
+        out[:header_size] = self.pack_header(compose_mode)
+        return out
 
-        for file in self.files:
+    def write_to(self, fp, type=-1, level="release") -> int:
+        """
+        Streams the Pak to fp without building it in memory,
+        the header is filled in last so fp has to be seekable.
+        Returns the amount of bytes written.
+        """
+        compose_mode = self.get_compose_mode(type)
+        if self.get_image(compose_mode) is not None:
+            return fp.write(self.image)
+
+        start = fp.tell()
+        fp.write(b"\x00" * self.get_header_size(compose_mode))
+        self.write_blobs(fp.write, compose_mode, level)
+        end = fp.tell()
+
+        fp.seek(start)
+        fp.write(self.pack_header(compose_mode))
+        fp.seek(end)
+        return end - start
+
+    def replace_tss(self, tss_data:bytes, level="release"):
+
+        # Only the Tss and what follows it changes in the serialized Pak
+        for index, file in enumerate(self.files):
             if file.data[0:3] == b'TSS':
-                file.data = tss_data
+                self.patch_entry(index, tss_data, level)
                 break
 
 
@@ -1,13 +1,20 @@
 from pathlib import Path
 from .cab import extract_cab_file
 from .pak import Pak
-def extract_sys_cab(sys_data_path:Path):
+def extract_sys_cab(sys_data_path:Path, all_dat=None, cache=None):
 
     files = ['logo_all.bin', 'menutext.bin', 'title.bin']
 
+    if all_dat is not None:
+        for name in all_dat.listdir('sysdata'):
+            file = sys_data_path / Path(name).name
+            if '.bin' in file.name:
+                extract_cab_file(file, sys_data_path / f'cab_{file.stem}', all_dat.view(name), cache)
+        return
+
     for file in sys_data_path.iterdir():
         if '.bin' in file.name:
-            extract_cab_file(file, sys_data_path / f'cab_{file.stem}')
+            extract_cab_file(file, sys_data_path / f'cab_{file.stem}', cache=cache)
 
 def get_extension(header:bytes):
     ext = '.pak'
@@ -21,35 +28,36 @@ def get_extension(header:bytes):
         ext = '.tm2'
 
     return ext
-def extract_lvl1(sys_data_path:Path):
+def extract_lvl1(sys_data_path:Path, cache=None):
 
     pak_files = ['menutex', 'title']
 
-    for file in sys_data_path.iterdir():
+    for pak_file in pak_files:
 
-        if file.stem in pak_files:
-            extract_pak_files(sys_data_path / f'cab_{file.stem}' / f'{file.stem}.dat', 3)
+        if (sys_data_path / f'cab_{pak_file}' / f'{pak_file}.dat').exists():
+            extract_pak_files(sys_data_path / f'cab_{pak_file}' / f'{pak_file}.dat', 3, cache)
 
 
-def extract_pak_files(pak_file_path:Path, type:int):
-    pak = Pak.from_path(pak_file_path, type)
+def extract_pak_files(pak_file_path:Path, type:int, cache=None):
     pak_folder = pak_file_path.parent / f'pak_{pak_file_path.stem}'
     pak_folder.mkdir(parents=True, exist_ok=True)
 
-    for ind, pak_file in enumerate(pak.files):
-        header = pak_file.data[0:4]
-        ext = get_extension(header)
+    with Pak.from_path(pak_file_path, type, cache) as pak:
+        pak.decompress_all()
+        for ind, pak_file in enumerate(pak.files):
+            header = bytes(pak_file.data[0:4])
+            ext = get_extension(header)
 
-        with open(pak_folder / f'{ind}{ext}', 'wb') as f:
-            f.write(pak_file.data)
-def extract_lvl2(sys_data_path:Path):
+            with open(pak_folder / f'{ind}{ext}', 'wb') as f:
+                f.write(pak_file.data)
+def extract_lvl2(sys_data_path:Path, cache=None):
     pak_files = ['menutex', 'title']
 
     for pak_file in pak_files:
         for file in (sys_data_path / f'cab_{pak_file}' / f'pak_{pak_file}').iterdir():
 
             if file.suffix == '.pak':
-                extract_pak_files(file, 3)
+                extract_pak_files(file, 3, cache)
 
 
 
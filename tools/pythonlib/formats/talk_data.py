@@ -16,8 +16,17 @@ class TalkData:
         self.root = etree.Element('SceneText')
 
 
-    def extract_fps4(self, destination_path:Path, copy_path:Path):
-        self.fps4.extract_files(destination_path=destination_path, copy_path=copy_path)
+    def close(self):
+        self.fps4.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def extract_fps4(self, destination_path:Path, copy_path:Path, cache=None):
+        self.fps4.extract_files(destination_path=destination_path, copy_path=copy_path, cache=cache)
 
     def initialiaze(self):
         self.root = etree.Element('SceneText')
@@ -18,8 +18,10 @@ weird_kanjies = {
 
 
 jsonTblTags = dict()
-with open('../Narikiri-Dungeon-X/Project/tbl_all.json') as f:
-    jsonraw = json.loads(f.read(), encoding="utf-8")
+with open('../Narikiri-Dungeon-X/Project/tbl_all.json', 'rb') as f:
+    # Kept as read, anything cached from decoded text is keyed on it
+    tbl_data = f.read()
+    jsonraw = json.loads(tbl_data.decode("utf-8"), encoding="utf-8")
     for k, v in jsonraw.items():
         jsonTblTags[k] = {int(k2, 16): v2 for k2, v2 in v.items()}
 
@@ -208,7 +208,8 @@ class Tss():
             entries = [entry for entry in struct_entries if int(entry.find("PointerOffset").text) == pointer_offset]
             self.struct_dict[pointer_offset].parse_xml_nodes(entries, self.list_status_insertion)
 
-    def copy_translations(self, original_path:Path, translated_path:Path):
+    @staticmethod
+    def copy_translations(original_path:Path, translated_path:Path):
 
         #Open translated XMLs
         tree = etree.parse(original_path)
@@ -1,4 +1,5 @@
 import os
+import mmap
 import shutil
 from os import stat_result
 
@@ -6,33 +7,64 @@ import pandas as pd
 
 from pathlib import Path
 import pyjson5 as json
-import pycdlib
 import subprocess
 import datetime
+import time
+from concurrent.futures import ProcessPoolExecutor
 import lxml.etree as etree
 from pythonlib.formats.FileIO import FileIO
 from pythonlib.formats.fps4 import Fps4
 from pythonlib.formats.tss import Tss
 from pythonlib.formats.pak import Pak
 from pythonlib.formats.map import extract_tss_from_map
-from pythonlib.formats.text_ndx import text_to_bytes, bytes_to_text
-from pythonlib.formats.cab import extract_cab_file
+from pythonlib.formats.text_ndx import text_to_bytes, bytes_to_text, tbl_data
+from pythonlib.formats.cab import extract_cab_file, make_cab_files, CAB_COMPRESSION_LEVELS
+from pythonlib.formats.iso import read_iso_files, extract_iso_files, get_changed_files, load_iso_manifest, save_iso_manifest, \
+    get_iso_fingerprint, load_build_manifest, save_build_manifest, new_build_manifest, patch_iso, SECTOR_SIZE
+from pythonlib.formats.alldat import AllDat, read_all_table, extract_all_members, pack_all_dat, resolve_hashes, \
+    save_hashes
 from pythonlib.formats.sysdata import extract_sys_cab, extract_lvl1, extract_lvl2
 import re
 from itertools import chain
 import io
 from tqdm import tqdm
 import struct
+from typing import Optional
 
+from pythonlib.utils.blob_cache import BlobCache, get_default_cache_dir, remove_file
 from pythonlib.formats.talk_data import TalkData
 from pythonlib.formats.character_data import CharacterData
 from pythonlib.formats.gim import convert_gim_to_png
 
 
+# ToolsNDX of the current batch worker process
+worker_tools = None
+
+
+def init_worker(tools: "ToolsNDX"):
+    global worker_tools
+    worker_tools = tools
+
+
+def run_job(tools: "ToolsNDX", method: str, job: tuple) -> tuple:
+    # (result, duration, error)
+    start = time.perf_counter()
+    try:
+        result = getattr(tools, method)(*job)
+    except Exception as e:
+        return None, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+    return result, time.perf_counter() - start, None
+
+
+def run_worker_job(method: str, job: tuple) -> tuple:
+    return run_job(worker_tools, method, job)
+
+
 class ToolsNDX():
 
 
-    def __init__(self, project_file: Path, insert_mask: list[str], changed_only: bool = False) -> None:
+    def __init__(self, project_file: Path, insert_mask: list[str], changed_only: bool = False,
+                 compression: str = "release") -> None:
         os.environ["PATH"] += os.pathsep + os.path.join(os.getcwd(), 'pythonlib', '../utils')
         base_path = project_file.parent
 
@@ -74,65 +106,111 @@ class ToolsNDX():
         self.list_status_insertion.extend(insert_mask)
         self.COMMON_TAG = r"(<[\w/]+:?\w+>)"
         self.changed_only = changed_only
+        self.compression = compression
         self.repo_path = str(base_path)
         self.file_dict = {
             "skit": "data/fc/fcscr",
             "story": "data/m"
         }
+        self.all_dat = None
+        self.eboot = None
+
+        # Shared between checkouts, NDX_CACHE_DIR="" disables it
+        cache_dir = get_default_cache_dir()
+        self.cache = BlobCache(cache_dir) if cache_dir is not None else None
 
-    def extract_iso(self, umd_iso: Path) -> None:
+    def __getstate__(self):
+        # The mmaps stay in this process, batch workers open their own
+        state = self.__dict__.copy()
+        state['all_dat'] = None
+        state['eboot'] = None
+        return state
+
+    def extract_iso(self, umd_iso: Path, workers: int = 8, stream_all: bool = False) -> dict[str, float]:
 
         print("Extracting ISO files...")
-        iso = pycdlib.PyCdlib()
-        iso.open(umd_iso)
         extract_to = self.paths["original_files"]
-        self.clean_folder(extract_to)
+        files = read_iso_files(umd_iso)
 
-        files = []
-        for dirname, _, filelist in iso.walk(iso_path="/"):
-            files += [dirname + "/" + x for x in filelist]
+        # Only rewrite the files whose extent changed since the last run
+        manifest = load_iso_manifest(self.paths["iso_manifest"])
+        if manifest is None:
+            self.clean_folder(extract_to)
+            changed = files
+        else:
+            changed = get_changed_files(umd_iso, files, extract_to, manifest)
+            print(f"{len(changed)}/{len(files)} files changed since last extraction")
 
-        for file in files:
+        # all.dat is then read from the UMD by get_all_dat
+        if stream_all:
+            all_relative = self.paths['original_all'].relative_to(extract_to).as_posix().lower()
+            changed = [file for file in changed if file.path.lower() != all_relative]
+            self.close_eboot()
+            self.paths['original_all'].unlink(missing_ok=True)
 
-            if 'UMD_DATA' in file:
-                out_path = extract_to / file[2:]
-            else:
-                out_path = extract_to/ file[1:]
+        timings = extract_iso_files(umd_iso, changed, extract_to, workers)
+        save_iso_manifest(self.paths["iso_manifest"], umd_iso, files)
 
-            out_path.parent.mkdir(parents=True, exist_ok=True)
+        if len(timings) == 0:
+            return timings
 
-            with iso.open_file_from_iso(iso_path=file) as f, open(str(out_path).split(";")[0], "wb+") as output:
-                with tqdm(total=f.length(), desc=f"Extracting {file[1:].split(';')[0]}", unit="B", unit_divisor=1024,
-                          unit_scale=True, leave=False) as pbar:
-                    while data := f.read(2048):
-                        output.write(data)
-                        pbar.update(len(data))
+        slowest = sorted(timings.items(), key=lambda x: x[1], reverse=True)[:5]
+        print("Slowest files: " + ", ".join(f"{name} ({duration:.2f}s)" for name, duration in slowest))
+        return timings
 
-        iso.close()
         #for element in self.paths['original_files'].iterdir():
         #    if (self.paths['original_files'] / element).is_dir():
         #        os.rename(self.paths['original_files'] / element, self.paths['original_files'] / "PSP_GAME")
         #    else:
         #        os.rename(self.paths['original_files'] / element), self.paths['original_files'] / "UMD_DATA.BIN")
 
-    def make_iso(self, game_iso) -> None:
-        #Clean old builds and create new one
-        self.clean_builds(self.paths["game_builds"])
-
-        # Set up new iso name and copy original iso in the folder
+    def make_iso(self, game_iso: Path, full_rebuild: bool = False) -> None:
+        builds_path = self.paths["game_builds"]
+        builds_path.mkdir(parents=True, exist_ok=True)
+        manifest_path = builds_path / "build_manifest.json"
 
         n: datetime.datetime = datetime.datetime.now()
-        new_iso = f"TalesofHearts_{n.year:02d}{n.month:02d}{n.day:02d}{n.hour:02d}{n.minute:02d}.nds"
+        new_iso = f"TalesofNDX_{n.year:02d}{n.month:02d}{n.day:02d}{n.hour:02d}{n.minute:02d}.iso"
         print(f'Making Iso {new_iso}...')
         self.new_iso = new_iso
-        shutil.copy(game_iso, self.paths['game_builds'] / new_iso)
 
-        path = self.folder_name / self.paths["final_files"]
+        # Patch the previous build in place when it was made from the same UMD
+        manifest = load_build_manifest(manifest_path)
+        if not full_rebuild and manifest is not None and manifest["iso"] == get_iso_fingerprint(game_iso) \
+                and (builds_path / manifest["build"]).exists():
+            (builds_path / manifest["build"]).rename(builds_path / new_iso)
+            manifest["build"] = new_iso
+        else:
+            self.clean_builds(builds_path)
+            shutil.copyfile(game_iso, builds_path / new_iso)
+            manifest = new_build_manifest(game_iso, new_iso)
+
+        # Every file in 3_patched except the temp folder replaces the one on the UMD
+        files = read_iso_files(game_iso)
+        iso_paths = {file.path.lower() for file in files}
+        patched = {}
+        for file in self.paths["final_files"].rglob("*"):
+            if file.is_file() and self.paths["temp_files"] not in file.parents and file.name != ".gitignore":
+                relative = file.relative_to(self.paths["final_files"]).as_posix().lower()
+                if relative in iso_paths:
+                    patched[relative] = file
+                else:
+                    print(f"{relative} is not on the UMD, skipping it")
 
+        written = patch_iso(builds_path / new_iso, game_iso, files, patched, manifest)
+        save_build_manifest(manifest_path, manifest)
+        print(f"{written / (1024 * 1024):.2f} MB written to {new_iso}")
 
     def patch_binaries(self):
         asm_path = self.paths["tools"] / "asm"
 
+        # Patch a copy of the cached decrypted eboot, not a fresh deceboot run
+        out_eboot = self.paths['final_files'] / 'PSP_GAME' / 'SYSDIR' / self.main_exe_name
+        if not out_eboot.exists():
+            out_eboot.parent.mkdir(parents=True, exist_ok=True)
+            with open(out_eboot, 'wb') as f:
+                f.write(self.get_eboot())
+
         env = os.environ.copy()
         env["PATH"] = f"{asm_path.as_posix()};{env['PATH']}"
 
@@ -142,7 +220,10 @@ class ToolsNDX():
                 str(self.paths["tools"] / "asm" / self.asm_file),
                 "-strequ",
                 "__OVERLAY3_PATH__",
-                str(self.paths["temp_files"] / 'overlay' / 'overlay_0003.bin')
+                str(self.paths["temp_files"] / 'overlay' / 'overlay_0003.bin'),
+                "-strequ",
+                "__EBOOT_PATH__",
+                str(out_eboot)
             ])
         if r.returncode != 0:
             raise ValueError("Error building code")
@@ -158,7 +239,7 @@ class ToolsNDX():
                     file.unlink(missing_ok=False)
 
     def clean_builds(self, path: Path) -> None:
-        target_files = sorted(list(path.glob("*.nds")), key=lambda x: x.name)[:-4]
+        target_files = sorted(list(path.glob("*.iso")), key=lambda x: x.name)[:-4]
         if len(target_files) != 0:
             print("Cleaning builds folder...")
             for file in target_files:
@@ -211,6 +292,8 @@ class ToolsNDX():
         for entry in tqdm(menu_json, desc='Extracting Menu Files'):
 
             file_path = self.paths["original_files"] / entry["file_path"]
+            if file_path.resolve() == (self.paths['extracted_eboot'] / self.main_exe_name).resolve():
+                file_path = self.get_eboot()
 
             with FileIO(file_path, "rb") as f:
                 xml_data = self.extract_menu_file(entry, f, keep_translations)
@@ -228,38 +311,42 @@ class ToolsNDX():
     def extract_bt_character_data(self):
         fps4_path = self.paths['extracted_files'] / 'All' / 'battle' / 'data' / 'BT_DATA' / 'BT_CHARACTER_DATA'
         copy_path = self.paths['temp_files'] / 'All' / 'battle' / 'data' / 'BT_DATA' / 'BT_CHARACTER_DATA'
-        character = CharacterData(fps4_path / 'bt_character_data.dat')
-        character.extract_fps4(destination_path= fps4_path / 'BT_CHARACTER_DATA', copy_path=copy_path)
-        character.extract_all_character(xml_path=self.paths['character_original'])    
+        with CharacterData(fps4_path / 'bt_character_data.dat') as character:
+            character.extract_fps4(destination_path= fps4_path / 'BT_CHARACTER_DATA', copy_path=copy_path, cache=self.cache)
+            character.extract_all_character(xml_path=self.paths['character_original'])
 
     def extract_text_talk(self):
         fps4_path = self.paths['extracted_files'] / 'All' / 'battle' / 'data' / 'BT_DATA' / 'BT_TEXT_TALK_DATA'
         copy_path = self.paths['temp_files'] / 'All' / 'battle' / 'data' / 'BT_DATA' / 'BT_TEXT_TALK_DATA'
-        talk = TalkData(fps4_path / 'bt_text_talk_data.dat')
-        talk.extract_fps4(destination_path= fps4_path / 'BT_TEXT_TALK_DATA', copy_path=copy_path)
-        talk.extract_all_talk(xml_path=self.paths['battle_original'])
+        with TalkData(fps4_path / 'bt_text_talk_data.dat') as talk:
+            talk.extract_fps4(destination_path= fps4_path / 'BT_TEXT_TALK_DATA', copy_path=copy_path, cache=self.cache)
+            talk.extract_all_talk(xml_path=self.paths['battle_original'])
 
 
     def extract_bt_data(self):
 
         fps4_path = self.paths['extracted_files'] / 'All' / 'battle' / 'data'
         copy_path = self.paths['temp_files'] / 'All' / 'battle' / 'data'
-        fps4 = Fps4(detail_path=fps4_path / 'bt_data_battle.dat',
-                    header_path=fps4_path / 'bt_data.b')
-        fps4.extract_files(destination_path=fps4_path / 'BT_DATA', copy_path=copy_path,
-                           decompressed=False)
+        with Fps4(detail_path=fps4_path / 'bt_data_battle.dat',
+                  header_path=fps4_path / 'bt_data.b',
+                  header_data=self.read_all_file('battle/data/bt_data.b'),
+                  detail_data=self.read_all_file('battle/data/bt_data_battle.dat')) as fps4:
+            fps4.extract_files(destination_path=fps4_path / 'BT_DATA', copy_path=copy_path,
+                               decompressed=False, cache=self.cache)
 
         for cab_file in (fps4_path / 'BT_DATA').iterdir():
-            extract_cab_file(cab_file, fps4_path / 'BT_DATA' / cab_file.stem)
+            extract_cab_file(cab_file, fps4_path / 'BT_DATA' / cab_file.stem, cache=self.cache)
             #self.extract_pak(fps4_path / 'BT_DATA' / cab_file.stem / f'{cab_file.stem}.dat', 3)
     
     def extract_townname(self):
         fps4_path = self.paths['extracted_files'] / 'All' / 'map' / 'data'
         copy_path = self.paths['temp_files'] / 'All' / 'map' / 'data'
-        fps4 = Fps4(detail_path=fps4_path / 'townname.dat',
-                    header_path=fps4_path / 'townname.b')
-        fps4.extract_files(destination_path=fps4_path / 'townname', copy_path=copy_path,
-                           decompressed=False) 
+        with Fps4(detail_path=fps4_path / 'townname.dat',
+                  header_path=fps4_path / 'townname.b',
+                  header_data=self.read_all_file('map/data/townname.b'),
+                  detail_data=self.read_all_file('map/data/townname.dat')) as fps4:
+            fps4.extract_files(destination_path=fps4_path / 'townname', copy_path=copy_path,
+                               decompressed=False, cache=self.cache)
         print(f"Extracted townname files to: {fps4_path / 'townname'}")                   
         
         # Convert extracted .gim files to .png
@@ -269,84 +356,226 @@ class ToolsNDX():
 
 
         
-    def extract_main_archive(self):
-        order = {}
-        order['order'] = []
+    def get_all_dat(self) -> Optional[AllDat]:
+        eboot_path = self.paths['extracted_eboot'] / self.main_exe_name
+        if self.all_dat is None and eboot_path.exists():
+            if self.paths['original_all'].exists():
+                self.all_dat = AllDat(self.paths['original_all'], read_all_table(self.get_eboot()), self.hashes)
+            elif (streamed := self.get_streamed_all()) is not None:
+                umd_iso, offset, size = streamed
+                self.all_dat = AllDat(umd_iso, read_all_table(self.get_eboot()), self.hashes, offset, size)
+        return self.all_dat
+
+    def get_streamed_all(self) -> Optional[tuple[Path, int, int]]:
+        # all.dat extent inside the UMD recorded by the last extract_iso
+        # Manifests written before streaming was added have no path, they can't be streamed from
+        manifest = load_iso_manifest(self.paths['iso_manifest'])
+        if manifest is None or manifest.get('path') is None or not Path(manifest['path']).exists():
+            return None
+
+        all_relative = self.paths['original_all'].relative_to(self.paths['original_files']).as_posix().lower()
+        for path, infos in manifest['files'].items():
+            if path.lower() == all_relative:
+                return Path(manifest['path']), infos['lba'] * SECTOR_SIZE, infos['size']
+        return None
+
+    def read_all_file(self, name: str) -> Optional[memoryview]:
+        # None means the stage reads the copy in 1_extracted/All instead
+        all_dat = self.get_all_dat()
+        if all_dat is None:
+            return None
+        return all_dat.view(name)
+
+    def iter_all_files(self, folder: str):
+        all_dat = self.get_all_dat()
+        if all_dat is not None:
+            for name in all_dat.listdir(folder):
+                yield self.paths['extracted_files'] / 'All' / name, all_dat.view(name)
+        else:
+            for file in (self.paths['extracted_files'] / 'All' / folder).iterdir():
+                if file.is_file():
+                    yield file, None
+
+    def extract_main_archive(self, write_files: bool = True):
 
         # Extract decrypted eboot
         self.extract_decripted_eboot()
 
-        # Open the eboot and go at the start of the offsets table
-        eboot = open(self.paths['extracted_eboot'] / self.main_exe_name, 'rb')
-        eboot.seek(0x1FF624)
-
-        print("Extract All.dat")
-        with open(self.paths['original_all'], "rb") as all_read:
-            while True:
-                file_info = struct.unpack('<3I', eboot.read(12))
-                if (file_info[2] == 0):
-                    break
-                hash_ = '%08X' % file_info[2]
-                final_name = hash_
-                if hash_ in self.hashes.keys():
-                    final_name = self.hashes[hash_]
-
-                self.extract_archive_file(file_info[0], file_info[1], final_name, all_read)
-                order['order'].append(hash_)
-
-            with open(self.paths['order'], 'w') as f:
-                f.write(json.dumps(order, indent=4))
-
-
-    def extract_archive_file(self, start:int, size:int, file_name:str, all_read):
-        all_read.seek(start, 0)
-        data = all_read.read(size)
-
-        (self.paths['extracted_files'] / 'All' / file_name).parent.mkdir(parents=True, exist_ok=True)
-        with open(self.paths['extracted_files'] / 'All' / file_name, mode='wb') as output_file:
-            output_file.write(data)
+        # Read the whole offsets table of the eboot at once
+        eboot = self.get_eboot()
+        entries = read_all_table(eboot)
+
+        # Name the hashes missing from hashes.json with the eboot filename table
+        unknown = {entry.hash for entry in entries if entry.hash not in self.hashes}
+        if len(unknown) > 0:
+            found = resolve_hashes(eboot, unknown, self.hashes)
+            if len(found) > 0:
+                print(f"Resolved {len(found)}/{len(unknown)} unknown hashes")
+                self.hashes.update(found)
+                save_hashes(self.paths['hashes'], self.hashes)
+
+        # Later stages can read the members through get_all_dat instead
+        if write_files:
+            print("Extract All.dat")
+            extract_all_members(self.get_all_dat(), self.paths['extracted_files'] / 'All')
+
+        order = {'order': [entry.hash for entry in entries]}
+        with open(self.paths['order'], 'w') as f:
+            f.write(json.dumps(order, indent=4))
+
+    def pack_main_archive(self):
+        print("Packing All.dat")
+        all_dat = self.get_all_dat()
+        if all_dat is None:
+            raise ValueError("Decrypted eboot and all.dat are needed to pack All.dat")
+
+        with open(self.paths['order'], encoding="utf-8") as f:
+            order = json.load(f)['order']
+
+        out_all = self.paths['final_files'] / self.paths['original_all'].relative_to(self.paths['original_files'])
+        out_eboot = self.paths['final_files'] / 'PSP_GAME' / 'SYSDIR' / self.main_exe_name
+        if not out_eboot.exists():
+            out_eboot.parent.mkdir(parents=True, exist_ok=True)
+            with open(out_eboot, 'wb') as f:
+                f.write(self.get_eboot())
+
+        written = pack_all_dat(all_dat, order, self.paths['temp_files'] / 'All', out_all, out_eboot,
+                               self.paths['temp_files'] / 'all_layout.json')
+        print(f"{written / (1024 * 1024):.2f} MB written to All.dat")
 
     def extract_decripted_eboot(self):
         print("Extracting Eboot")
         original_eboot = self.paths['original_files'] / 'PSP_GAME' / 'SYSDIR' / self.main_exe_name
         self.paths['extracted_eboot'].mkdir(parents=True, exist_ok=True)
         dest_eboot = self.paths['extracted_eboot'] / self.main_exe_name
+        self.close_eboot()
+
+        # Only decrypt an encrypted eboot that was never seen before
+        if self.cache is not None:
+            with open(original_eboot, 'rb') as f:
+                key = self.cache.get_key('deceboot', f.read())
+            entry = self.cache.get('deceboot', key)
+            if entry is not None:
+                # Copied, the menu insertion writes back into this file
+                self.cache.copy(entry, 'eboot', dest_eboot)
+                return
 
-        args = ["deceboot.exe", str(original_eboot), str(dest_eboot)]
-        #env["PATH"] = f"{env['PATH']}"
+        # deceboot writes into an existing file, it may be one linked by an older run
+        remove_file(dest_eboot)
+        args = [str(self.paths['utils'] / "deceboot.exe"), str(original_eboot), str(dest_eboot)]
 
-        listFile = subprocess.run(
+        r = subprocess.run(
             args,
             cwd= self.paths['utils'],
-            shell=True,
             stdout=subprocess.DEVNULL
             )
-
-    def extract_all_story_sb(self, keep_translations=False):
+        if r.returncode != 0 or not dest_eboot.exists():
+            raise ValueError("Error decrypting the eboot")
+
+        if self.cache is not None:
+            self.cache.put('deceboot', key, {'eboot': dest_eboot})
+
+    def get_eboot(self) -> mmap.mmap:
+        # Decrypted eboot mapped once and shared by every stage
+        if self.eboot is None:
+            dest_eboot = self.paths['extracted_eboot'] / self.main_exe_name
+            if not dest_eboot.exists():
+                self.extract_decripted_eboot()
+            with open(dest_eboot, 'rb') as f:
+                self.eboot = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.eboot
+
+    def close_eboot(self):
+        if self.all_dat is not None:
+            self.all_dat.close()
+            self.all_dat = None
+        if self.eboot is not None:
+            self.eboot.close()
+            self.eboot = None
+
+    def extract_all_story_sb(self, keep_translations=False, workers: Optional[int] = None):
         print("Extracting Story and SB files")
-        cab_path = self.paths['extracted_files'] / 'All' / 'map' / 'pack'
-
-        for cab_file in cab_path.iterdir():
-
-            if ('ep_' in cab_file.name or 'sb_' in cab_file.name) and cab_file.suffix == '.cab':
-                extract_cab_file(cab_file, cab_path / f'cab_{cab_file.stem}')
-                self.extract_pak(cab_path / f'cab_{cab_file.stem}' / f'{cab_file.stem}.dat', 3)
-                self.extract_tss(cab_path / f'cab_{cab_file.stem}' / f'pak_{cab_file.stem}' / f'{cab_file.stem}.tss',
-                                 'story',
-                                 keep_translations)
+        cab_files = [cab_file for cab_file, _ in self.iter_all_files('map/pack')
+                     if ('ep_' in cab_file.name or 'sb_' in cab_file.name) and cab_file.suffix == '.cab']
+        self.run_batch('extract_cab_scene', [(cab_file, 'story', keep_translations) for cab_file in cab_files], workers)
 
-
-    def extract_all_skits(self, keep_translations=False):
+    def extract_all_skits(self, keep_translations=False, workers: Optional[int] = None):
         print("Extracting Skits")
         self.paths['skit_original'].mkdir(parents=True, exist_ok=True)
-        cab_path = self.paths['extracted_files'] / 'All' / 'chat'
+        cab_files = [cab_file for cab_file, _ in self.iter_all_files('chat')]
+        self.run_batch('extract_cab_scene', [(cab_file, 'skit', keep_translations) for cab_file in cab_files], workers)
+
+    def extract_cab_scene(self, cab_file: Path, file_type: str, keep_translations: bool) -> dict[str, float]:
+        # cab -> pak -> tss -> xml for a single scene, runs inside the batch workers
+        cab_folder = cab_file.parent / f'cab_{cab_file.stem}'
+        data = None
+        if self.get_all_dat() is not None:
+            data = self.read_all_file(cab_file.relative_to(self.paths['extracted_files'] / 'All').as_posix())
+
+        throughput = extract_cab_file(cab_file, cab_folder, data, self.cache) or {}
+        self.extract_pak(cab_folder / f'{cab_file.stem}.dat', 3)
+        self.extract_tss(cab_folder / f'pak_{cab_file.stem}' / f'{cab_file.stem}.tss', file_type, keep_translations)
+        return throughput
+
+    def run_batch(self, method: str, jobs: list[tuple], workers: Optional[int] = None) -> list:
+        """
+        Runs self.method(*job) for every job over a process pool, results come back
+        in the order of the jobs and a failure doesn't stop the other files.
+        """
+        results = []
+        if workers == 1:
+            for job in jobs:
+                results.append(run_job(self, method, job))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(self,)) as executor:
+                results = list(tqdm(executor.map(run_worker_job, [method] * len(jobs), jobs),
+                                    total=len(jobs), desc=method))
+
+        throughput = {}
+        for result, _, error in results:
+            if error is None and isinstance(result, dict):
+                throughput.update(result)
+        self.print_cab_throughput(throughput)
+        self.print_batch_summary([job[0] for job in jobs], results)
+        return [result for result, _, _ in results]
+
+    def print_batch_summary(self, files: list, results: list[tuple]):
+        durations = {Path(file).name: duration for file, (_, duration, _) in zip(files, results)}
+        failures = [(Path(file).name, error) for file, (_, _, error) in zip(files, results) if error is not None]
+        slowest = sorted(durations, key=durations.get, reverse=True)[:5]
+
+        print(f"{len(files)} files, {len(failures)} failed, {sum(durations.values()):.2f}s of work"
+              + (f", slowest: {', '.join(f'{name} ({durations[name]:.2f}s)' for name in slowest)}" if slowest else ""))
+        for name, error in failures:
+            print(f"  {name}: {error}")
+
+    def pack_cab_files(self, folder: str, workers: Optional[int] = None):
+        # Every repacked temp_files/All/{folder}/cab_x/x.dat goes back into x.cab next to it
+        temp_path = self.paths['temp_files'] / 'All' / folder
+        jobs = []
+        for cab_folder in sorted(temp_path.glob('cab_*')):
+            stem = cab_folder.name[len('cab_'):]
+            dat_file = cab_folder / f'{stem}.dat'
+            if not dat_file.exists():
+                continue
 
-        for cab_file in [file for file in cab_path.iterdir() if file.is_file()]:
-            extract_cab_file(cab_file, cab_path / f'cab_{cab_file.stem}')
-            self.extract_pak(cab_path / f'cab_{cab_file.stem}' / f'{cab_file.stem}.dat', 3)
-            self.extract_tss(cab_path / f'cab_{cab_file.stem}' / f'pak_{cab_file.stem}' / f'{cab_file.stem}.tss',
-                             'skit',
-                             keep_translations)
+            original = self.read_all_file(f'{folder}/{stem}.cab')
+            original = bytes(original) if original is not None else \
+                self.paths['extracted_files'] / 'All' / folder / f'{stem}.cab'
+            jobs.append((dat_file, temp_path / f'{stem}.cab', original))
+
+        start = time.perf_counter()
+        sizes = make_cab_files(jobs, workers, CAB_COMPRESSION_LEVELS[self.compression])
+        print(f"Created {len(sizes)} cab files in {time.perf_counter() - start:.2f}s")
+
+    def print_cab_throughput(self, throughput: dict[str, float]):
+        # Cabs served from the cache are not decoded and don't show up here
+        if len(throughput) == 0:
+            return
+        slowest = min(throughput, key=throughput.get)
+        print(f"Decoded {len(throughput)} cab files, "
+              f"average {sum(throughput.values()) / len(throughput):.2f} MB/s, "
+              f"slowest {slowest} at {throughput[slowest]:.2f} MB/s")
 
     def pack_all_story_sb(self):
         print("Recreating Story files...")
@@ -355,6 +584,7 @@ class ToolsNDX():
         files = ['ep_000_010']
         cab_path = self.paths['extracted_files'] / 'All' / 'map' / 'pack'
 
+        paks = {}
         for file in files:
 
             #Load original Pak file
@@ -369,14 +599,18 @@ class ToolsNDX():
             original_tss.pack_tss_file(destination_path=destination_path ,
                               xml_path=xml_path)
 
-            original_pak.replace_tss(tss.data)
-
-            #Copy new Pak file
-
-
-            #Recreate cab file in final destination
+            with open(destination_path, 'rb') as f:
+                original_pak.replace_tss(f.read(), self.compression)
+            paks[file] = original_pak
 
+        #Copy new Pak files, the other members are written as they were
+        for file, pak in paks.items():
+            pak_path = self.paths['temp_files'] / 'All' / 'map' / 'pack' / f'cab_{file}' / f'{file}.dat'
+            with pak, open(pak_path, 'wb') as f:
+                pak.write_to(f, 3, self.compression)
 
+        #Recreate cab files in final destination
+        self.pack_cab_files('map/pack')
 
         out_path = self.paths["temp_files"] / "DAT" / "SCPK"
         out_path.mkdir(parents=True, exist_ok=True)
@@ -406,30 +640,51 @@ class ToolsNDX():
             with open(out_path / file.name, "wb") as f:
                 f.write(curr_scpk.to_bytes())
     def extract_tss(self, tss_file:Path, file_type:str, keep_translations=False):
+        original_path = self.paths[f'{file_type}_original'] / tss_file.with_suffix('.xml').name
+        translated_path = self.paths[f'{file_type}_xml'] / tss_file.with_suffix('.xml').name
+
+        # Reuse the XML generated for the same TSS bytes and encoding table, translations are merged again
+        if self.cache is not None:
+            with open(tss_file, 'rb') as f:
+                key = self.cache.get_key('tss', f.read(), tbl_data)
+            entry = self.cache.get('tss', key)
+            if entry is not None:
+                if (entry / 'xml').exists():
+                    self.cache.copy(entry, 'xml', original_path)
+                    if keep_translations:
+                        Tss.copy_translations(original_path, translated_path)
+                return
+
         tss_obj = Tss(path=tss_file, list_status_insertion=self.list_status_insertion)
 
         if (len(tss_obj.struct_dict) > 0) or (len(tss_obj.string_list) > 0):
-            original_path = self.paths[f'{file_type}_original'] / tss_file.with_suffix('.xml').name
-            translated_path = self.paths[f'{file_type}_xml'] / tss_file.with_suffix('.xml').name
             tss_obj.extract_to_xml(original_path= original_path,
                                        translated_path=translated_path,
-                                       keep_translations=keep_translations)
+                                       keep_translations=False)
+            if self.cache is not None:
+                self.cache.put('tss', key, {'xml': original_path})
+            if keep_translations:
+                Tss.copy_translations(original_path, translated_path)
+
+        elif self.cache is not None:
+            self.cache.put('tss', key, {})
 
     def extract_all_map(self, keep_translations=False):
         print("Extracting Map files")
         cab_path = self.paths['extracted_files'] / 'All' / 'map'
 
         (cab_path / 'map_extracted').mkdir(parents=True, exist_ok=True)
-        for cab_file in cab_path.iterdir():
-            if cab_file.parent.stem == 'map' and cab_file.is_file() and cab_file.suffix == '.bin' and 'field' not in cab_file.name:
-                extract_cab_file(cab_file, cab_path / 'map_extracted' / f'cab_{cab_file.stem}')
+        for cab_file, data in self.iter_all_files('map'):
+            if cab_file.suffix == '.bin' and 'field' not in cab_file.name:
+                extract_cab_file(cab_file, cab_path / 'map_extracted' / f'cab_{cab_file.stem}', data, self.cache)
                 extract_tss_from_map(cab_path / 'map_extracted' / f'cab_{cab_file.stem}' / f'{cab_file.stem}.dat')
 
     def extract_field(self):
         print("Extracting Field.bin")
         cab_path = self.paths['extracted_files'] / 'All' / 'map'
         field_folder = cab_path / 'field_extracted'
-        extract_cab_file(cab_path / 'field.bin', field_folder / 'cab_field')
+        extract_cab_file(cab_path / 'field.bin', field_folder / 'cab_field', self.read_all_file('map/field.bin'),
+                         self.cache)
 
 
         size = os.path.getsize(field_folder / 'cab_field' / 'field.dat')
@@ -446,22 +701,18 @@ class ToolsNDX():
     def extract_all_sysdata(self):
         print("Extracting Sysdata files")
         sysdata_path = self.paths['extracted_files'] / 'All' / 'sysdata'
-        extract_sys_cab(sysdata_path)
-        extract_lvl1(sysdata_path)
-        extract_lvl2(sysdata_path)
+        extract_sys_cab(sysdata_path, self.get_all_dat(), self.cache)
+        extract_lvl1(sysdata_path, self.cache)
+        extract_lvl2(sysdata_path, self.cache)
         
         menutex_path = self.paths['extracted_files'] / 'All' / 'sysdata' / 'cab_menutex'
         output_path = self.paths['graphic_png']
         convert_gim_to_png(menutex_path, output_path)
 
     def extract_pak(self, file_path:Path, format:int):
-        try:
-            pak = Pak.from_path(file_path, format)
-
-        except struct.error:
-            print(f'Error with {file_path.stem}')
-
-        else:
+        # Errors go up to the caller, run_batch reports them per file
+        with Pak.from_path(file_path, format, self.cache) as pak:
+            pak.decompress_all()
             for file in pak.files:
 
                 ext = '.bin'
@@ -601,12 +852,14 @@ class ToolsNDX():
                     with open(dest, "wb") as g:
                         g.write(f.read())
 
-                #Copy in the patched folder
+                #Copy in the patched folder, paths into 1_extracted can be links to the cache
                 if entry['friendly_name'] != "Arm9":
                     (self.paths['final_files'] / entry['file_path']).parent.mkdir(parents=True, exist_ok=True)
+                    remove_file(self.paths['final_files'] / entry['file_path'])
                     shutil.copyfile(src=dest,
                                 dst=self.paths['final_files'] / entry['file_path'])
                 else:
+                    remove_file(self.paths['final_files'] / 'arm9.bin')
                     shutil.copyfile(src=dest,
                                     dst=self.paths['final_files'] / 'arm9.bin')
 
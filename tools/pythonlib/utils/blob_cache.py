@@ -0,0 +1,101 @@
+import hashlib
+import os
+import shutil
+import stat
+import uuid
+from pathlib import Path
+from typing import Optional, Union
+
+# Bump when the output of an operation changes so old entries are ignored
+# (2: tss keys include the encoding table)
+CACHE_VERSION = 2
+
+
+def remove_file(path: Path) -> None:
+    """
+    Outputs can be hardlinks into the cache, they are removed before being written
+    so the new content never goes through the shared file.
+    """
+    try:
+        path.unlink(missing_ok=True)
+    except PermissionError:
+        # Windows can't delete read-only files
+        os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        path.unlink()
+
+
+def get_default_cache_dir() -> Optional[Path]:
+    # NDX_CACHE_DIR="" disables the cache
+    cache_dir = os.environ.get("NDX_CACHE_DIR")
+    if cache_dir is None:
+        return Path.home() / ".cache" / "ndx"
+    if cache_dir == "":
+        return None
+    return Path(cache_dir)
+
+
+class BlobCache:
+    """
+    Content addressed store for the results of deterministic extraction steps,
+    an entry is a folder of output files keyed by the operation and its input bytes.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def get_key(self, operation: str, *inputs) -> str:
+        digest = hashlib.sha1(f"{operation}:{CACHE_VERSION}".encode("utf-8"))
+        for data in inputs:
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def get_entry_path(self, operation: str, key: str) -> Path:
+        return self.root / operation / key[:2] / key
+
+    def get(self, operation: str, key: str) -> Optional[Path]:
+        entry = self.get_entry_path(operation, key)
+        return entry if entry.exists() else None
+
+    def put(self, operation: str, key: str, files: dict[str, Union[bytes, memoryview, Path]]) -> Path:
+        entry = self.get_entry_path(operation, key)
+        if entry.exists():
+            return entry
+
+        # Write in a private folder then rename so readers never see half an entry
+        staging = entry.parent / f".{key}.{uuid.uuid4().hex}"
+        staging.mkdir(parents=True, exist_ok=True)
+        for name, content in files.items():
+            (staging / name).parent.mkdir(parents=True, exist_ok=True)
+            if isinstance(content, Path):
+                shutil.copyfile(content, staging / name)
+            else:
+                with open(staging / name, "wb") as f:
+                    f.write(content)
+            # Read-only so anything writing into a linked output fails instead of changing the entry
+            os.chmod(staging / name, stat.S_IREAD | stat.S_IRGRP | stat.S_IROTH)
+
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(staging, ignore_errors=True)
+        return entry
+
+    def read(self, entry: Path, name: str) -> bytes:
+        with open(entry / name, "rb") as f:
+            return f.read()
+
+    def link(self, entry: Path, name: str, destination: Path) -> None:
+        # Replace instead of writing through an existing hardlink into the cache
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        remove_file(destination)
+        try:
+            os.link(entry / name, destination)
+        except OSError:
+            self.copy(entry, name, destination)
+
+    def copy(self, entry: Path, name: str, destination: Path) -> None:
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        remove_file(destination)
+        shutil.copyfile(entry / name, destination)
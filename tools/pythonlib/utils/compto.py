@@ -0,0 +1,317 @@
+"""
+Portable compto codec, same format as comptolib.dll (pakcomposer's complib.c).
+
+Data is LZSS over a 0x1000 byte ring prefilled by FillTextBuffer, flag bytes
+are read from the lowest bit and a set bit is a literal. A match is 2 bytes,
+a 12 bit ring position and a 4 bit length. Version 3 keeps the last length
+code for runs of a single byte and version 0 is literals only.
+"""
+from collections import deque
+
+import numpy as np
+
+RING_SIZE = 0x1000
+RING_MASK = RING_SIZE - 1
+MIN_MATCH = 3
+MIN_RUN = 4
+MAX_SHORT_RUN = 0x12
+MAX_RUN = 0x112
+
+# Bits per token, the flag bit included
+LITERAL_COST = 9
+MATCH_COST = 17
+LONG_RUN_COST = 25
+
+# Greedy takes the longest match, lazy also looks one byte ahead, optimal finds the cheapest parse
+EFFORTS = ("greedy", "lazy", "optimal")
+
+
+def get_max_match(version: int) -> int:
+    return 0x11 if version == 3 else 0x12
+
+
+def get_ring() -> bytes:
+    # FillTextBuffer: n 0 n 0 n 0 n 0 for every byte, then n FF n FF n FF n, zeros after
+    ring = bytearray(RING_SIZE)
+    pos = 0
+    for n in range(0x100):
+        ring[pos:pos + 8] = bytes((n, 0)) * 4
+        pos += 8
+    for n in range(0x100):
+        ring[pos:pos + 7] = bytes((n, 0xFF, n, 0xFF, n, 0xFF, n))
+        pos += 7
+    return bytes(ring)
+
+
+def get_history(version: int) -> bytes:
+    # Writing starts at N - F, so the ring is rotated to end right before the first output byte
+    ring = get_ring()
+    max_match = get_max_match(version)
+    return ring[RING_SIZE - max_match:] + ring[:RING_SIZE - max_match]
+
+
+def encode_stored(input: bytes) -> bytes:
+    # Version 0, every flag bit set so the data is only literals (same output as Encode with version 0)
+    output = bytearray()
+    for start in range(0, max(len(input), 1), 8):
+        chunk = input[start:start + 8]
+        output.append((1 << len(chunk)) - 1)
+        output += chunk
+    return bytes(output)
+
+
+def decompress(input: bytes, version: int, size: int = None) -> bytes:
+    max_match = get_max_match(version)
+    output = bytearray(get_history(version))
+    end = RING_SIZE + size if size is not None else None
+    length = len(input)
+    pos = 0
+    flags = 0
+
+    while True:
+        flags >>= 1
+        if not flags & 0x100:
+            if pos >= length:
+                break
+            flags = input[pos] | 0xFF00
+            pos += 1
+
+        if flags & 1:
+            if pos >= length:
+                break
+            output.append(input[pos])
+            pos += 1
+        else:
+            if pos + 2 > length:
+                break
+            i = input[pos] | ((input[pos + 1] & 0xF0) << 4)
+            j = (input[pos + 1] & 0x0F) + MIN_MATCH - 1
+            pos += 2
+
+            if version != 3 or j < max_match:
+                # Ring position back to a distance, a full ring away is the slot about to be written
+                count = j + 1
+                distance = ((len(output) - max_match - i) & RING_MASK) or RING_SIZE
+                source = len(output) - distance
+                if distance >= count:
+                    output += output[source:source + count]
+                else:
+                    output += (output[source:] * (count // distance + 1))[:count]
+            else:
+                if i < 0x100:
+                    if pos >= length:
+                        break
+                    value = input[pos]
+                    pos += 1
+                    count = i + max_match + 2
+                else:
+                    value = i & 0xFF
+                    count = (i >> 8) + MIN_MATCH
+                output += bytes((value,)) * count
+
+        if end is not None and len(output) > end:
+            raise ValueError("Compto data is larger than its header size")
+
+    output = bytes(output[RING_SIZE:])
+    if size is not None and len(output) < size:
+        # Decode leaves the rest of the buffer as it was
+        output += b"\x00" * (size - len(output))
+    return output
+
+
+def get_runs(data: bytes) -> list[int]:
+    # Length of the run of equal bytes starting at every position
+    if len(data) == 0:
+        return []
+    array = np.frombuffer(data, dtype=np.uint8)
+    starts = np.flatnonzero(np.r_[True, array[1:] != array[:-1]])
+    ends = np.r_[starts[1:], len(array)]
+    runs = np.repeat(ends, ends - starts) - np.arange(len(array))
+    return np.minimum(runs, MAX_RUN).tolist()
+
+
+def find_matches(buffer: bytes, max_match: int) -> tuple[list[int], list[int]]:
+    """
+    Longest match (up to max_match) at every position of buffer and its source,
+    a 0 length when there is none. Positions are indexes in history + data,
+    so a match can reach back into the prefilled ring.
+    """
+    array = np.frombuffer(buffer, dtype=np.uint8).astype(np.int64)
+    size = len(array)
+    lengths = np.zeros(size, dtype=np.int64)
+    sources = np.zeros(size, dtype=np.int64)
+    if size < MIN_MATCH:
+        return lengths.tolist(), sources.tolist()
+
+    # Strings of each length are ranked by refining the ranks of the length before. Sorting
+    # rank and position packed together puts every occurrence right after the previous one
+    shift = size.bit_length()
+    mask = (1 << shift) - 1
+    ranks = array[:size - 1] * 256 + array[1:]
+    for length in range(MIN_MATCH, max_match + 1):
+        count = size - length + 1
+        if count <= 0:
+            break
+        keys = ranks[:count] * 256 + array[length - 1:]
+        packed = np.sort((keys << shift) | np.arange(count))
+        order = packed & mask
+        keys = packed >> shift
+        same = keys[1:] == keys[:-1]
+        previous = np.full(count, -1, dtype=np.int64)
+        previous[order[1:]] = np.where(same, order[:-1], -1)
+
+        # A match can't start more than a ring back
+        found = (previous >= 0) & (previous >= np.arange(count) - RING_SIZE)
+        if not found.any():
+            break
+        lengths[:count][found] = length
+        sources[:count][found] = previous[found]
+
+        ranks = np.empty(count, dtype=np.int64)
+        ranks[order] = np.cumsum(np.r_[0, ~same])
+
+    return lengths.tolist(), sources.tolist()
+
+
+def write_tokens(tokens: list[tuple[int, int, int]], version: int) -> bytes:
+    # Tokens are (length, source, run value), a length of 0 is a literal of the run value
+    max_match = get_max_match(version)
+    output = bytearray()
+    flags_pos = 0
+    mask = 0x100
+    for length, source, value in tokens:
+        if mask == 0x100:
+            flags_pos = len(output)
+            output.append(0)
+            mask = 1
+
+        if length == 0:
+            output[flags_pos] |= mask
+            output.append(value)
+        elif source < 0:
+            if length <= MAX_SHORT_RUN:
+                output += bytes((value, 0x0F | ((length - MIN_MATCH) << 4)))
+            else:
+                output += bytes((length - MAX_SHORT_RUN - 1, 0x0F, value))
+        else:
+            ring_pos = (source - max_match) & RING_MASK
+            output += bytes((ring_pos & 0xFF, ((ring_pos >> 4) & 0xF0) | (length - MIN_MATCH)))
+        mask <<= 1
+    return bytes(output)
+
+
+def parse_greedy(data: bytes, version: int, lengths: list[int], sources: list[int],
+                 lazy: bool) -> list[tuple[int, int, int]]:
+    runs = get_runs(data) if version == 3 else None
+    size = len(data)
+
+    def get_longest(pos: int) -> tuple[int, int]:
+        # Runs win ties like Encode does
+        if runs is not None and runs[pos] >= MIN_RUN and runs[pos] >= lengths[pos + RING_SIZE]:
+            return runs[pos], -1
+        return lengths[pos + RING_SIZE], sources[pos + RING_SIZE]
+
+    tokens = []
+    pos = 0
+    while pos < size:
+        length, source = get_longest(pos)
+        # Lazy matching, a literal costs about half a match so the next position has to match
+        # at least 2 more bytes for the deferral to pay off
+        if length < MIN_MATCH or (lazy and pos + 1 < size and get_longest(pos + 1)[0] > length + 1):
+            tokens.append((0, 0, data[pos]))
+            pos += 1
+        else:
+            tokens.append((length, source, data[pos]))
+            pos += length
+    return tokens
+
+
+def parse_optimal(data: bytes, version: int, lengths: list[int], sources: list[int]) -> list[tuple[int, int, int]]:
+    runs = get_runs(data) if version == 3 else [0] * len(data)
+    size = len(data)
+
+    # Cheapest way to encode the data from every position to the end.
+    # Long runs can reach 0x100 positions ahead, their window only moves down so its minimum is
+    # kept in a deque of positions, the newest on the left and the cheapest on the right
+    costs = [0] * (size + 1)
+    choices = [1] * size
+    long_runs = deque()
+    long_runs_low = -1
+
+    def add_long_run(index: int) -> None:
+        while long_runs and costs[long_runs[0]] >= costs[index]:
+            long_runs.popleft()
+        long_runs.appendleft(index)
+
+    for pos in range(size - 1, -1, -1):
+        best = LITERAL_COST + costs[pos + 1]
+        choice = 1
+        # Every match costs the same, so only the longest one at each position matters
+        length = lengths[pos + RING_SIZE]
+        if length >= MIN_MATCH:
+            window = costs[pos + MIN_MATCH:pos + length + 1]
+            cost = min(window)
+            if MATCH_COST + cost < best:
+                best = MATCH_COST + cost
+                choice = MIN_MATCH + window.index(cost)
+        run = runs[pos]
+        if run >= MIN_RUN:
+            window = costs[pos + MIN_RUN:pos + min(run, MAX_SHORT_RUN) + 1]
+            cost = min(window)
+            if MATCH_COST + cost < best:
+                best = MATCH_COST + cost
+                choice = -(MIN_RUN + window.index(cost))
+        if run > MAX_SHORT_RUN:
+            low = pos + MAX_SHORT_RUN + 1
+            if long_runs_low != low + 1:
+                long_runs.clear()
+                for index in range(pos + run, low - 1, -1):
+                    add_long_run(index)
+            else:
+                add_long_run(low)
+            long_runs_low = low
+            while long_runs[-1] > pos + run:
+                long_runs.pop()
+            cost = costs[long_runs[-1]]
+            if LONG_RUN_COST + cost < best:
+                best = LONG_RUN_COST + cost
+                choice = -(long_runs[-1] - pos)
+        costs[pos] = best
+        choices[pos] = choice
+
+    tokens = []
+    pos = 0
+    while pos < size:
+        choice = choices[pos]
+        if choice == 1:
+            tokens.append((0, 0, data[pos]))
+            pos += 1
+        elif choice < 0:
+            tokens.append((-choice, -1, data[pos]))
+            pos -= choice
+        else:
+            tokens.append((choice, sources[pos + RING_SIZE], data[pos]))
+            pos += choice
+    return tokens
+
+
+def compress(input: bytes, version: int = 3, effort: str = "optimal") -> bytes:
+    if effort not in EFFORTS:
+        raise ValueError(f"Unknown compto effort {effort}")
+    if version == 0:
+        return encode_stored(input)
+    if version not in (1, 3):
+        raise ValueError(f"Unknown compto version {version}")
+
+    data = bytes(input)
+    lengths, sources = find_matches(get_history(version) + data, get_max_match(version))
+    if effort == "optimal":
+        return write_tokens(parse_optimal(data, version, lengths, sources), version)
+
+    output = write_tokens(parse_greedy(data, version, lengths, sources, False), version)
+    if effort == "lazy":
+        # Deferring can still lose locally, lazy never does worse than greedy
+        lazy_output = write_tokens(parse_greedy(data, version, lengths, sources, True), version)
+        if len(lazy_output) < len(output):
+            output = lazy_output
+    return output
@@ -1,6 +1,12 @@
 import ctypes
+import os
 import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional, Union
+
+from . import compto
 
 # Error codes
 SUCCESS               =  0
@@ -61,34 +67,40 @@ def RaiseError(error: int):
 
 comptolib_path = Path(__file__).parent / "comptolib.dll"
 
-comptolib = ctypes.cdll.LoadLibrary(str(comptolib_path))
-compto_decode = comptolib.Decode
-compto_decode.argtypes = (
-    ctypes.c_int,
-    ctypes.c_void_p,
-    ctypes.c_int,
-    ctypes.c_void_p,
-    ctypes.POINTER(ctypes.c_uint),
-)
-compto_decode.restype = ctypes.c_int
-
-compto_encode = comptolib.Encode
-compto_encode.argtypes = (
-    ctypes.c_int,
-    ctypes.c_void_p,
-    ctypes.c_int,
-    ctypes.c_void_p,
-    ctypes.POINTER(ctypes.c_uint),
-)
-compto_encode.restype = ctypes.c_int
-
-compto_fdecode = comptolib.DecodeFile
-compto_fdecode.argtypes = ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_int
-compto_fdecode.restype = ctypes.c_int
-
-compto_fencode = comptolib.EncodeFile
-compto_fencode.argtypes = ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_int
-compto_fencode.restype = ctypes.c_int
+# Hosts that can't load the DLL (Linux) go through the portable codec in compto.py
+try:
+    comptolib = ctypes.cdll.LoadLibrary(str(comptolib_path))
+except OSError:
+    comptolib = None
+
+if comptolib is not None:
+    compto_decode = comptolib.Decode
+    compto_decode.argtypes = (
+        ctypes.c_int,
+        ctypes.c_void_p,
+        ctypes.c_int,
+        ctypes.c_void_p,
+        ctypes.POINTER(ctypes.c_uint),
+    )
+    compto_decode.restype = ctypes.c_int
+
+    compto_encode = comptolib.Encode
+    compto_encode.argtypes = (
+        ctypes.c_int,
+        ctypes.c_void_p,
+        ctypes.c_int,
+        ctypes.c_void_p,
+        ctypes.POINTER(ctypes.c_uint),
+    )
+    compto_encode.restype = ctypes.c_int
+
+    compto_fdecode = comptolib.DecodeFile
+    compto_fdecode.argtypes = ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_int
+    compto_fdecode.restype = ctypes.c_int
+
+    compto_fencode = comptolib.EncodeFile
+    compto_fencode.argtypes = ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_int
+    compto_fencode.restype = ctypes.c_int
 
 
 class ComptoFile:
@@ -103,44 +115,156 @@ class ComptoFile:
         return len(self.data)
 
 
-def compress_data(input: bytes, raw: bool = False, version: int = 3) -> bytes:
-    input_size = len(input)
-    output_size = ((input_size * 9) // 8) + 10
-    output = b"\x00" * output_size
-    output_size = ctypes.c_uint(output_size)
-    error = compto_encode(version, input, input_size, output, ctypes.byref(output_size))
-    RaiseError(error)
+# fast is for test builds, release is what ships. They only differ without the DLL
+COMPRESSION_LEVELS = ("fast", "release")
 
-    if not raw:
-        output = (
-            struct.pack("<b", version)
-            + struct.pack("<L", output_size.value)
-            + struct.pack("<L", input_size)
-            + output[: output_size.value]
-        )
 
-    return output
+# Scratch output of the DLL calls, one per thread so the pools never share it
+arenas = threading.local()
+
 
+def get_arena(size: int) -> ctypes.Array:
+    arena = getattr(arenas, "buffer", None)
+    if arena is None or len(arena) < size:
+        # Grow geometrically so a run of bigger members doesn't reallocate every time
+        arena = ctypes.create_string_buffer(max(size, 2 * len(arena) if arena is not None else 0x10000))
+        arenas.buffer = arena
+    return arena
 
-def decompress_data(input: bytes, raw: bool = False, version: int = 3) -> bytes:
-    if raw:
-        input_size = len(input)
-        output_size = input_size * 10
+
+def get_input(input, offset: int = 0) -> Union[bytes, ctypes.c_void_p, ctypes.Array]:
+    # bytes are passed by pointer, writable buffers are wrapped, only read-only views are copied
+    if isinstance(input, bytes):
+        return ctypes.c_void_p(ctypes.cast(input, ctypes.c_void_p).value + offset) if offset else input
+    view = memoryview(input).cast("B")
+    if not view.readonly:
+        return (ctypes.c_char * (view.nbytes - offset)).from_buffer(view, offset)
+    return view[offset:].tobytes()
+
+
+def decompress_portable(input: bytes, version: int, size: Optional[int] = None) -> memoryview:
+    if version not in (0, 1, 3):
+        RaiseError(ERROR_UNKNOWN_VERSION)
+    try:
+        return memoryview(compto.decompress(bytes(input), version, size))
+    except ValueError:
+        RaiseError(ERROR_BAD_INPUT)
+
+
+def compress_data(input: bytes, raw: bool = False, version: int = 3, level: str = "release",
+                  effort: Optional[str] = None) -> memoryview:
+    # The DLL encodes both levels in the member's version, effort forces the portable encoder.
+    # Without the DLL release uses its optimal parse and fast the cheaper greedy one
+    if level not in COMPRESSION_LEVELS:
+        raise ValueError(f"Unknown compression level {level}")
+    if comptolib is None and effort is None:
+        effort = "greedy" if level == "fast" else "optimal"
+
+    header_size = 0 if raw else 9
+    input_size = len(input)
+    payload = None
+    if effort is not None:
+        if version not in (0, 1, 3):
+            RaiseError(ERROR_UNKNOWN_VERSION)
+        payload = compto.compress(input, version, effort)
+
+    if payload is not None:
+        output = bytearray(header_size + len(payload))
+        output[header_size:] = payload
+        output_size = len(payload)
+    elif input_size == 0:
+        # Encode returns before setting the size on empty input
+        output, output_size = bytearray(header_size), 0
     else:
-        version = struct.unpack("<b", input[:1])[0]
-        input_size, output_size = struct.unpack("<2L", input[1:9])
+        arena = get_arena(((input_size * 9) // 8) + 10)
+        output_size = ctypes.c_uint(len(arena))
+        error = compto_encode(version, get_input(input), input_size, arena, ctypes.byref(output_size))
+        RaiseError(error)
 
-    output = b"\x00" * output_size
-    input = input[9:]
+        output_size = output_size.value
+        output = bytearray(header_size + output_size)
+        output[header_size:] = memoryview(arena).cast("B")[:output_size]
 
-    error = compto_decode(
-        version, input, input_size, output, ctypes.byref(ctypes.c_uint(output_size))
-    )
+    if not raw:
+        struct.pack_into("<bLL", output, 0, version, output_size, input_size)
+    return memoryview(output)
+
+
+def decompress_data(input: bytes, raw: bool = False, version: int = 3) -> memoryview:
+    if not raw:
+        version, input_size, output_size = struct.unpack_from("<bLL", input)
+        if len(input) - 9 < input_size:
+            raise ComptoBadInputError("Bad Input")
+        # The DLL has no decoder for version 0
+        if comptolib is None or version == 0:
+            return decompress_portable(memoryview(input)[9:9 + input_size], version, output_size)
+
+        # The size is known, decode straight into the result
+        output = bytearray(output_size)
+        error = compto_decode(version, get_input(input, 9), input_size,
+                              (ctypes.c_char * output_size).from_buffer(output), ctypes.byref(ctypes.c_uint(output_size)))
+        RaiseError(error)
+        return memoryview(output)
+
+    if comptolib is None or version == 0:
+        return decompress_portable(input, version)
+
+    # Raw data has no size, Decode stops with a bad input error when the arena fills up so grow and retry
+    # up to the largest expansion possible (3 byte repeats of 0x113 bytes)
+    input_size = len(input)
+    input = get_input(input)
+    max_size = input_size * 0x60 + 0x120
+    arena = get_arena(min(input_size * 4, max_size))
+    while True:
+        output_size = ctypes.c_uint(len(arena))
+        error = compto_decode(version, input, input_size, arena, ctypes.byref(output_size))
+        if error != ERROR_BAD_INPUT or len(arena) >= max_size:
+            break
+        arena = get_arena(min(len(arena) * 2, max_size))
     RaiseError(error)
-    return output
+    return memoryview(bytearray(memoryview(arena).cast("B")[:output_size.value]))
+
+
+# ctypes drops the GIL during Encode/Decode, so threads are enough to use every core with the DLL
+# (the portable codec only releases it in its numpy parts)
+executor: Optional[ThreadPoolExecutor] = None
+executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="compto")
+        return executor
+
+
+def compress_many(inputs: list[bytes], raw: bool = False, versions: Union[int, list[int]] = 3,
+                  level: str = "release", effort: Optional[str] = None) -> list[memoryview]:
+    if isinstance(versions, int):
+        versions = [versions] * len(inputs)
+    if len(inputs) < 2:
+        return [compress_data(data, raw, version, level, effort) for data, version in zip(inputs, versions)]
+
+    return list(get_executor().map(lambda data, version: compress_data(data, raw, version, level, effort),
+                                   inputs, versions))
+
+
+def decompress_many(inputs: list[bytes], raw: bool = False, version: int = 3) -> list[memoryview]:
+    if len(inputs) < 2:
+        return [decompress_data(data, raw, version) for data in inputs]
+
+    return list(get_executor().map(lambda data: decompress_data(data, raw, version), inputs))
 
 
 def compress_file(input: str, output: str, raw: bool = False, version: int = 3) -> None:
+    if comptolib is None:
+        with open(input, "rb") as f:
+            data = compress_data(f.read(), raw, version)
+        with open(output, "wb") as f:
+            f.write(data)
+        return
+
     error = compto_fencode(input.encode("utf-8"), output.encode("utf-8"), raw, version)
     RaiseError(error)
 
@@ -148,6 +272,13 @@ def compress_file(input: str, output: str, raw: bool = False, version: int = 3)
 def decompress_file(
     input: str, output: str, raw: bool = False, version: int = 3
 ) -> None:
+    if comptolib is None:
+        with open(input, "rb") as f:
+            data = decompress_data(f.read(), raw, version)
+        with open(output, "wb") as f:
+            f.write(data)
+        return
+
     error = compto_fdecode(input.encode("utf-8"), output.encode("utf-8"), raw, version)
     RaiseError(error)
 
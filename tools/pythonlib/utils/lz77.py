@@ -0,0 +1,215 @@
+"""
+Nintendo LZ10/LZ11 (LZ77) codec, the formats of CUE's lzss and lzx tools.
+
+A 4 byte header holds the type and the decompressed size, then flag bytes
+are read from the highest bit and a set bit is a match copying from up to
+0x1000 bytes back. Encoded data is VRAM safe like the -evn/-evb modes,
+a match never copies the byte that was just written.
+"""
+import struct
+from typing import Optional
+
+import numpy as np
+
+LZ_TYPES = {"LZ10": 0x10, "LZ11": 0x11}
+WINDOW_SIZE = 0x1000
+MIN_MATCH = 3
+MAX_MATCH = {"LZ10": 0x12, "LZ11": 0x10110}
+# VRAM is written 16 bits at a time, so the previous byte can't be a source
+MIN_DISTANCE = 2
+# Longest match measured for every position, longer LZ11 matches are extended while parsing
+MATCH_CAP = 0x20
+
+
+def get_lz_type(data: bytes) -> Optional[str]:
+    if len(data) < 4:
+        return None
+    for c_type, code in LZ_TYPES.items():
+        if data[0] == code:
+            return c_type
+    return None
+
+
+def decompress(data: bytes) -> bytes:
+    c_type = get_lz_type(data)
+    if c_type is None:
+        raise ValueError("Data isn't LZ10 or LZ11 compressed")
+
+    size = struct.unpack_from("<I", data)[0] >> 8
+    pos = 4
+    if size == 0 and c_type == "LZ11" and len(data) >= 8:
+        # Sizes over 24 bits are stored right after the header
+        size = struct.unpack_from("<I", data, 4)[0]
+        pos = 8
+    if size == 0 and len(data) > 4:
+        # Empty data is only a header, raw data that happens to start with 10 00 00 00 isn't LZ
+        raise ValueError("LZ header has no size")
+
+    output = bytearray()
+    try:
+        while len(output) < size:
+            flags = data[pos]
+            pos += 1
+            for bit in range(8):
+                if len(output) >= size:
+                    break
+                if not flags & (0x80 >> bit):
+                    output.append(data[pos])
+                    pos += 1
+                    continue
+
+                if c_type == "LZ10":
+                    length = (data[pos] >> 4) + MIN_MATCH
+                    distance = (((data[pos] & 0xF) << 8) | data[pos + 1]) + 1
+                    pos += 2
+                else:
+                    indicator = data[pos] >> 4
+                    if indicator == 0:
+                        length = (((data[pos] & 0xF) << 4) | (data[pos + 1] >> 4)) + 0x11
+                        distance = (((data[pos + 1] & 0xF) << 8) | data[pos + 2]) + 1
+                        pos += 3
+                    elif indicator == 1:
+                        length = (((data[pos] & 0xF) << 12) | (data[pos + 1] << 4) | (data[pos + 2] >> 4)) + 0x111
+                        distance = (((data[pos + 2] & 0xF) << 8) | data[pos + 3]) + 1
+                        pos += 4
+                    else:
+                        length = indicator + 1
+                        distance = (((data[pos] & 0xF) << 8) | data[pos + 1]) + 1
+                        pos += 2
+
+                source = len(output) - distance
+                if source < 0:
+                    raise ValueError("LZ match starts before the data")
+                if distance >= length:
+                    output += output[source:source + length]
+                else:
+                    output += (output[source:] * (length // distance + 1))[:length]
+    except IndexError:
+        raise ValueError("LZ data ends before its decompressed size") from None
+
+    return bytes(output[:size])
+
+
+def find_matches(data: bytes, max_match: int) -> tuple[list[int], list[int]]:
+    """
+    Longest match (up to MATCH_CAP) and its distance at every position, a 0 length
+    when there is none. The source is the closest one with the longest match.
+    """
+    size = len(data)
+    cap = min(max_match, MATCH_CAP)
+    found_matches = np.zeros(size, dtype=np.int64)
+    if size < MIN_MATCH:
+        return [0] * size, [0] * size
+
+    # Strings of each length are ranked by refining the ranks of the length before like
+    # compto does. Sorting rank and position packed together puts every occurrence right
+    # after the previous one. Bytes past the end are 256 so nothing matches past it
+    padded = np.full(size + cap, 256, dtype=np.int32)
+    padded[:size] = np.frombuffer(data, dtype=np.uint8)
+    shift = size.bit_length()
+    mask = (1 << shift) - 1
+    positions = np.arange(size)
+    ranks = padded[:size] * np.int64(257) + padded[1:size + 1]
+    for length in range(MIN_MATCH, cap + 1):
+        keys = ranks * 257 + padded[positions + length - 1]
+        packed = np.sort((keys << shift) | positions)
+        positions = packed & mask
+        keys = packed >> shift
+        same = keys[1:] == keys[:-1]
+
+        # In runs the closest one is the byte just written, the one before it is used instead
+        sources = positions[:-1]
+        too_close = same & (positions[1:] - sources < MIN_DISTANCE)
+        if too_close.any():
+            before = np.full(len(sources), -1, dtype=np.int64)
+            before[1:] = np.where(same[:-1], positions[:-2], -1)
+            sources = np.where(too_close, before, sources)
+        distance = positions[1:] - sources
+        found = same & (sources >= 0) & (distance <= WINDOW_SIZE)
+        if not found.any():
+            break
+        found_matches[positions[1:][found]] = (length << 16) | distance[found]
+
+        # Only strings seen twice can repeat with one more byte, the rest drops out
+        repeated = np.r_[same, False] | np.r_[False, same]
+        ranks = np.cumsum(np.r_[0, ~same])[repeated]
+        positions = positions[repeated]
+
+    return (found_matches >> 16).tolist(), (found_matches & 0xFFFF).tolist()
+
+
+def get_match_length(data: bytes, source: int, pos: int, low: int, limit: int) -> int:
+    # The first low bytes are known to match. Slices are compared in doubling steps then
+    # bisected instead of walking byte by byte, LZ11 matches go up to 64K but most are short
+    step = 0x10
+    while True:
+        high = min(low + step, limit)
+        if data[source + low:source + high] != data[pos + low:pos + high]:
+            break
+        if high == limit:
+            return limit
+        low = high
+        step <<= 1
+    while high - low > 1:
+        middle = (low + high) >> 1
+        if data[source + low:source + middle] == data[pos + low:pos + middle]:
+            low = middle
+        else:
+            high = middle
+    return low
+
+
+def encode_match(c_type: str, length: int, distance: int) -> bytes:
+    distance -= 1
+    if c_type == "LZ10":
+        return bytes((((length - MIN_MATCH) << 4) | (distance >> 8), distance & 0xFF))
+    if length <= 0x10:
+        return bytes((((length - 1) << 4) | (distance >> 8), distance & 0xFF))
+    if length <= 0x110:
+        length -= 0x11
+        return bytes((length >> 4, ((length & 0xF) << 4) | (distance >> 8), distance & 0xFF))
+    length -= 0x111
+    return bytes((0x10 | (length >> 12), (length >> 4) & 0xFF, ((length & 0xF) << 4) | (distance >> 8), distance & 0xFF))
+
+
+def compress(data: bytes, c_type: str) -> bytes:
+    if c_type not in LZ_TYPES:
+        raise ValueError(f"Unknown LZ type {c_type}")
+    data = bytes(data)
+    size = len(data)
+    if size > 0xFFFFFF:
+        raise ValueError("LZ data can't be over 16MB")
+
+    # Greedy parse over the matches found at every position
+    max_match = MAX_MATCH[c_type]
+    cap = min(max_match, MATCH_CAP)
+    lengths, distances = find_matches(data, max_match)
+    output = bytearray(struct.pack("<I", LZ_TYPES[c_type] | (size << 8)))
+    flags_pos = 0
+    mask = 0
+    pos = 0
+    while pos < size:
+        if mask == 0:
+            flags_pos = len(output)
+            output.append(0)
+            mask = 0x80
+
+        length = lengths[pos]
+        if length >= MIN_MATCH:
+            distance = distances[pos]
+            if length == cap and max_match > cap:
+                # Only LZ11 goes past the cap, the rest is measured from the same source
+                length = get_match_length(data, pos - distance, pos, cap, min(max_match, size - pos))
+
+        if length >= MIN_MATCH:
+            output[flags_pos] |= mask
+            output += encode_match(c_type, length, distance)
+        else:
+            output.append(data[pos])
+            length = 1
+        mask >>= 1
+        pos += length
+
+    # Padded to 4 bytes like the tools do
+    output += bytes(-len(output) & 3)
+    return bytes(output)
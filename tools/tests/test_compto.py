@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+from pythonlib.utils import compto
+
+
+def get_samples() -> list[bytes]:
+    rng = random.Random(0)
+    text = "Narikiri Dungeon X ".encode("utf-8") * 0x40
+    return [
+        b"",
+        b"a",
+        bytes(0x400),
+        bytes(0x10) + b"\xFF" * 0x200 + bytes(range(256)),
+        bytes(rng.randrange(256) for _ in range(0x800)),
+        bytes(rng.randrange(4) for _ in range(0x2000)),
+        text,
+    ]
+
+
+@pytest.mark.parametrize("effort", compto.EFFORTS)
+@pytest.mark.parametrize("version", (1, 3))
+@pytest.mark.parametrize("data", get_samples(), ids=range(len(get_samples())))
+def test_round_trip(data, version, effort):
+    compressed = compto.compress(data, version, effort)
+    assert compto.decompress(compressed, version, len(data)) == data
+
+
+def test_stored_round_trip():
+    data = bytes(range(256)) * 2
+    assert compto.decompress(compto.compress(data, 0), 0, len(data)) == data
+
+
+@pytest.mark.parametrize("version", (1, 3))
+def test_efforts_are_ordered(version):
+    for data in get_samples():
+        greedy, lazy, optimal = (len(compto.compress(data, version, effort)) for effort in compto.EFFORTS)
+        assert optimal <= lazy <= greedy
+
+
+def test_unknown_arguments():
+    with pytest.raises(ValueError):
+        compto.compress(b"data", 3, "fastest")
+    with pytest.raises(ValueError):
+        compto.compress(b"data", 2)
@@ -0,0 +1,106 @@
+import random
+import struct
+
+import pytest
+
+from pythonlib.utils import lz77
+
+
+def get_samples() -> list[bytes]:
+    rng = random.Random(0)
+    tile = bytes(rng.randrange(16) for _ in range(0x20))
+    return [
+        b"",
+        b"a",
+        b"ab",
+        b"abc",
+        bytes(0x1000),
+        b"\x12\x34" * 0x800,
+        bytes(rng.randrange(256) for _ in range(0x800)),
+        bytes(rng.randrange(4) for _ in range(0x3000)),
+        (tile * 8 + bytes(0x100)) * 0x20,
+        bytes(0x20000) + bytes(range(256)) * 0x10,
+    ]
+
+
+def get_distances(data: bytes) -> list[int]:
+    # Distance of every match in LZ10/LZ11 data
+    c_type = lz77.get_lz_type(data)
+    size = struct.unpack_from("<I", data)[0] >> 8
+    distances = []
+    pos = 4
+    written = 0
+    while written < size:
+        flags = data[pos]
+        pos += 1
+        for bit in range(8):
+            if written >= size:
+                break
+            if not flags & (0x80 >> bit):
+                pos += 1
+                written += 1
+                continue
+
+            indicator = data[pos] >> 4
+            if c_type == "LZ10":
+                length = indicator + 3
+            elif indicator == 0:
+                length = (((data[pos] & 0xF) << 4) | (data[pos + 1] >> 4)) + 0x11
+                pos += 1
+            elif indicator == 1:
+                length = (((data[pos] & 0xF) << 12) | (data[pos + 1] << 4) | (data[pos + 2] >> 4)) + 0x111
+                pos += 2
+            else:
+                length = indicator + 1
+            distances.append((((data[pos] & 0xF) << 8) | data[pos + 1]) + 1)
+            pos += 2
+            written += length
+    return distances
+
+
+@pytest.mark.parametrize("c_type", lz77.LZ_TYPES)
+@pytest.mark.parametrize("data", get_samples(), ids=range(len(get_samples())))
+def test_round_trip(data, c_type):
+    compressed = lz77.compress(data, c_type)
+    assert lz77.get_lz_type(compressed) == c_type
+    assert len(compressed) % 4 == 0
+    assert lz77.decompress(compressed) == data
+
+
+@pytest.mark.parametrize("c_type", lz77.LZ_TYPES)
+def test_vram_safe(c_type):
+    data = bytes(0x100) + b"\x01\x02" * 0x100 + bytes(random.Random(1).randrange(3) for _ in range(0x1000))
+    distances = get_distances(lz77.compress(data, c_type))
+    assert distances
+    assert all(lz77.MIN_DISTANCE <= distance <= lz77.WINDOW_SIZE for distance in distances)
+
+
+def test_long_lz11_match():
+    data = bytes(range(256)) + bytes(0x8000)
+    compressed = lz77.compress(data, "LZ11")
+    # 256 literals, then the zeros take a couple of long matches
+    assert len(compressed) < 0x140
+    assert lz77.decompress(compressed) == data
+
+
+def test_compresses_repeated_data():
+    data = bytes(range(32)) * 0x100
+    assert len(lz77.compress(data, "LZ10")) < len(data) // 4
+
+
+def test_find_matches_closest_longest():
+    data = b"abcdXabcdYabcdX"
+    lengths, distances = lz77.find_matches(data, lz77.MAX_MATCH["LZ10"])
+    # abcdX is 10 bytes back, the closer abcd only has 4 bytes in common
+    assert (lengths[10], distances[10]) == (5, 10)
+    assert (lengths[5], distances[5]) == (4, 5)
+    assert lengths[0] == 0
+
+
+def test_decompress_errors():
+    with pytest.raises(ValueError):
+        lz77.decompress(b"\x00\x10\x00\x00")
+    with pytest.raises(ValueError):
+        lz77.decompress(b"\x11\x00\x00\x00\x12\x34")
+    with pytest.raises(ValueError):
+        lz77.decompress(lz77.compress(bytes(0x100), "LZ10")[:6])